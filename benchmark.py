@@ -0,0 +1,182 @@
+"""
+Time the stages of the embryo analysis on synthetic embryos of growing size, and compare the timings with an earlier run
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys, os, time, json, platform, shutil, tempfile
+import numpy
+import shared
+import embryo_analysis, synthetic
+
+SIZES = [1000, 10000, 100000, 1000000]	# numbers of cells
+FORMATS = ["xls", "csv", "npz"]	# output formats timed by default
+SLOWER = 1.2	# compare() reports stages that take this many times longer than in the baseline
+
+def measure(results, num_cells, stage, function, repeats): # time repeats calls of function, and add them to results as one entry
+	# A stage that raises (e.g. more cells than an .xls worksheet holds) is recorded as skipped, with the error
+	entry = {"cells": num_cells, "stage": stage}
+	try:
+		seconds = []
+		for r in range(repeats):
+			start = time.perf_counter()
+			function()
+			seconds.append(time.perf_counter() - start)
+		entry["seconds"] = seconds
+		entry["best"] = min(seconds)
+	except Exception as e:
+		entry["skipped"] = type(e).__name__ + ": " + str(e)
+	results.append(entry)
+	return entry
+
+def region_geometry(regions): # boundaries of the regions and the corners of their slices, as built by Region
+	for region in regions:
+		region.xs_ys_calc()
+		region.single_cell_boundaries()
+		region.left_corners_calc()
+		region.right_corners_calc()
+		region.create_dynamic_slice()
+
+def slice_regions(regions): # assign the cells to the slices
+	for region in regions:
+		region.assign_cells()
+
+def region_statistics(regions): # per-slice statistics, recomputed instead of taken from the cache
+	for region in regions:
+		region.stats = {}
+		region.slice_statistics()
+
+def benchmark_embryo(num_cells, directory, num_sec = 4, in_format = 0, split = 0.5, middle = 0.0, repeats = 3, formats = FORMATS, seed = 1, angle = 46.543, delta_angle = 0.0328):
+	# Time every stage for one synthetic embryo of num_cells cells; directory receives the input workbook and the outputs
+	# Returns one entry per stage: {"cells", "stage", "seconds": time of every repeat, "best"}, or "skipped" instead of the times
+	results = []
+	filename = directory + "/embryo" + str(num_cells) + ".xls"
+	try:
+		synthetic.write_workbook(filename, num_cells, num_sec, in_format, split, middle, seed)
+		measure(results, num_cells, "parse", lambda: embryo_analysis.read_cells(filename, num_sec, in_format, middle=1 if in_format and middle > 0 else 0), repeats)
+		os.remove(filename)
+	except ValueError as e:	# too many cells for an .xls worksheet
+		results.append({"cells": num_cells, "stage": "parse", "skipped": "ValueError: " + str(e)})
+
+	cells = synthetic.synthetic_cells(num_cells, num_sec, in_format, split, middle, seed)
+	measure(results, num_cells, "shift", lambda: embryo_analysis.prepare_cells(cells), repeats)
+	analysis = embryo_analysis.analyze_embryo(cells, angle, delta_angle)
+	regions = analysis.regions
+	measure(results, num_cells, "geometry", lambda: region_geometry(regions), repeats)
+	measure(results, num_cells, "slicing", lambda: slice_regions(regions), repeats)
+	measure(results, num_cells, "statistics", lambda: region_statistics(regions), repeats)
+	for output_format in formats:
+		output = directory + "/output" + str(num_cells) + "_" + output_format
+		measure(results, num_cells, "write_" + output_format, lambda: embryo_analysis.write_results(output, analysis, embryo_analysis.NO_PLOT, output_format), repeats)
+		shutil.rmtree(output, ignore_errors=True)
+	num_slices = sum(region.num_slices for region in regions)
+	for entry in results:
+		entry["slices"] = num_slices
+	return results
+
+def run_benchmark(sizes = SIZES, directory = None, **options): # benchmark_embryo for every size, with the settings and machine of the run
+	# options are passed to benchmark_embryo; without a directory, a temporary one is used and removed afterwards
+	temporary = directory is None
+	if temporary:
+		directory = tempfile.mkdtemp(prefix="benchmark")
+	else:
+		directory = shared.ensureDir(directory)
+	try:
+		results = []
+		for num_cells in sizes:
+			results += benchmark_embryo(num_cells, directory, **options)
+	finally:
+		if temporary:
+			shutil.rmtree(directory, ignore_errors=True)
+	environment = {"python": platform.python_version(), "numpy": numpy.__version__, "platform": platform.platform(), "machine": platform.machine(), "cpus": os.cpu_count()}
+	settings = dict(options)
+	settings["sizes"] = list(sizes)
+	return {"settings": settings, "environment": environment, "results": results}
+
+def compare(baseline, current, slower = SLOWER): # (cells, stage, current/baseline best time, regressed) of the stages timed in both runs
+	best = {}
+	for entry in baseline["results"]:
+		if "best" in entry:
+			best[(entry["cells"], entry["stage"])] = entry["best"]
+	ratios = []
+	for entry in current["results"]:
+		key = (entry["cells"], entry["stage"])
+		if "best" in entry and key in best and best[key] > 0:
+			ratio = entry["best"] / best[key]
+			ratios.append((entry["cells"], entry["stage"], ratio, ratio > slower))
+	return ratios
+
+def main():
+	args = sys.argv[1:]
+	num_args = len(args)
+	output = None
+	baseline = None
+	directory = None
+	sizes = SIZES
+	options = {}
+	if num_args % 2 != 0:
+		usage()
+	for arg in range(0, num_args - 1, 2):
+		option = args[arg]
+		value = args[arg + 1]
+		if option == '-o' or option == '--output-file': # .json file receiving the timings
+			output = value
+		elif option == '-b' or option == '--baseline': # .json file of an earlier run to compare with
+			baseline = value
+		elif option == '-d' or option == '--work-directory':
+			directory = value
+		elif option == '-c' or option == '--cells':
+			sizes = [shared.toInt(v) for v in value.split(',')]
+		elif (option == '-n' or option == '--num-sec') and shared.isInt(value) and int(value) > 0:
+			options["num_sec"] = int(value)
+		elif (option == '-f' or option == '--input-format') and shared.isInt(value):
+			options["in_format"] = int(value)==1
+		elif (option == '-sp' or option == '--split') and shared.isFloat(value) and 0 <= float(value) <= 1:
+			options["split"] = float(value)
+		elif (option == '-m' or option == '--middle-section') and shared.isFloat(value) and 0 <= float(value) < 1:
+			options["middle"] = float(value)
+		elif (option == '-r' or option == '--repeats') and shared.isInt(value) and int(value) > 0:
+			options["repeats"] = int(value)
+		elif option == '-w' or option == '--output-formats':
+			options["formats"] = value.split(',')
+			for output_format in options["formats"]:
+				if not embryo_analysis.writers.available(output_format):
+					usage()
+		elif (option == '-seed' or option == '--seed') and shared.isInt(value):
+			options["seed"] = int(value)
+		else:
+			usage()
+	if output is None:
+		usage()
+
+	report = run_benchmark(sizes, directory, **options)
+	with open(output, "w") as f:
+		json.dump(report, f, indent=1)
+	for entry in report["results"]:
+		timing = ("%.4f s" % entry["best"]) if "best" in entry else "skipped (" + entry["skipped"] + ")"
+		print("%9d cells  %-12s %s" % (entry["cells"], entry["stage"], timing))
+	if baseline is not None:
+		with open(baseline) as f:
+			ratios = compare(json.load(f), report)
+		for num_cells, stage, ratio, regressed in ratios:
+			print("%9d cells  %-12s %.2fx baseline%s" % (num_cells, stage, ratio, "  SLOWER" if regressed else ""))
+
+def usage():
+	print("benchmark.py: Invalid command-line arguments.")
+	print("Format: python benchmark.py -o <output .json file> -b <optional:.json file of an earlier run to compare with> -c <optional:comma separated numbers of cells, default 1000,10000,100000,1000000> -n <optional:number of sections, default 4> -f <optional:0 or 1 to specify input format> -sp <optional:fraction of cells in the left half> -m <optional:fraction of cells in a middle section, input format 1 only> -r <optional:repeats of every stage, default 3> -w <optional:comma separated output formats, default xls,csv,npz> -d <optional:work directory, a temporary one by default> -seed <optional:random seed>")
+	print("Stages that cannot run at a size, such as parsing or writing more cells than an .xls worksheet holds, are reported as skipped.")
+	exit(1)
+
+if __name__ == "__main__":
+	main()
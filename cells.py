@@ -0,0 +1,114 @@
+"""
+Columnar storage for the cells (nuclei) of an embryo
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy
+
+# Values of CellTable.side
+UNSPLIT = -1	# not assigned to a half yet
+LEFT = 0	# left (upper) PSM, or the whole PSM for lateral view images
+RIGHT = 1	# right (lower) PSM
+
+class CellTable: # store the position and two expression levels of every cell as parallel numpy arrays
+	def __init__(self, x, y, z, her1, her7, section, side = None, CB = 0.0, YB = 0.0, num_sec = None):
+		self.x = numpy.asarray(x, dtype=float)	# x position, already mirrored (-xpos from the input file)
+		self.y = numpy.asarray(y, dtype=float)
+		self.z = numpy.asarray(z, dtype=float)
+		self.her1 = numpy.asarray(her1, dtype=float)
+		self.her7 = numpy.asarray(her7, dtype=float)
+		self.section = numpy.asarray(section, dtype=int)	# index of the image section the cell was read from
+		if side is None:
+			self.side = numpy.full(len(self.x), UNSPLIT, dtype=numpy.int8)
+		else:
+			self.side = numpy.asarray(side, dtype=numpy.int8)
+		self.CB = CB	# background noise mean for her1
+		self.YB = YB	# background noise mean for her7
+		if num_sec is None:
+			num_sec = int(self.section.max()) + 1 if len(self.section) > 0 else 0
+		self.num_sec = num_sec	# number of image sections; rows with a larger section index hold middle section cells
+
+	def __len__(self):
+		return len(self.x)
+
+	def her1_bgN(self, index = slice(None)): # background normalized her1 levels of the cells at index
+		return self.her1[index] - self.CB
+
+	def her7_bgN(self, index = slice(None)): # background normalized her7 levels of the cells at index
+		return self.her7[index] - self.YB
+
+	def with_background(self, CB, YB): # same cells (sharing the arrays) with different background noise means
+		return CellTable(self.x, self.y, self.z, self.her1, self.her7, self.section, self.side, CB, YB, self.num_sec)
+
+	def cell(self, i):
+		return Cell(self, i)
+
+	def cells(self, index): # Cell views for the given rows
+		return [Cell(self, i) for i in index]
+
+	@classmethod
+	def from_cell_lists(cls, cell_lists, CB = 0.0, YB = 0.0): # build a table from lists of per-cell objects, one list per section
+		# CB, YB: background noise means of the cells, as given to read_cells
+		columns = [[], [], [], [], [], []]
+		for i in range(len(cell_lists)):
+			for cell in cell_lists[i]:
+				columns[0].append(cell.xpos)
+				columns[1].append(cell.ypos)
+				columns[2].append(cell.zpos)
+				columns[3].append(cell.her1)
+				columns[4].append(cell.her7)
+				columns[5].append(i)
+		return cls(columns[0], columns[1], columns[2], columns[3], columns[4], columns[5], None, CB, YB)
+
+class Cell: # view of one row of a CellTable, for code written against one object per cell
+	def __init__(self, table, index):
+		self.table = table
+		self.index = int(index)
+
+	@property
+	def xpos(self):
+		return float(self.table.x[self.index])
+
+	@xpos.setter
+	def xpos(self, value):
+		self.table.x[self.index] = value
+
+	@property
+	def ypos(self):
+		return float(self.table.y[self.index])
+
+	@ypos.setter
+	def ypos(self, value):
+		self.table.y[self.index] = value
+
+	@property
+	def zpos(self):
+		return float(self.table.z[self.index])
+
+	@property
+	def her1(self):
+		return float(self.table.her1[self.index])
+
+	@property
+	def her7(self):
+		return float(self.table.her7[self.index])
+
+	@property
+	def her1_bgN(self): # Background normalization for her1 count
+		return self.her1 - self.table.CB
+
+	@property
+	def her7_bgN(self): # Background normalization for her7 count
+		return self.her7 - self.table.YB
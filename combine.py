@@ -0,0 +1,210 @@
+"""
+Pool the slice statistics of many embryos, aligned by region and slice index, one embryo at a time
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys, os, csv
+import numpy
+import xlrd
+import shared
+from stats import Moments
+
+VARIABLES = ["her1_bgN", "her7_bgN"]	# background normalized levels pooled across embryos
+COMBINED = "combined_slices.csv"	# written to the output folder of a batch
+
+def embryo_slices(analysis): # per-slice statistics of an EmbryoAnalysis needed for pooling: region -> {"num_cells", "<variable>_mean", "<variable>_var"}
+	slices = {}
+	for name in analysis.slice_stats:
+		stats = analysis.slice_stats[name]
+		slices[name] = {"num_cells": numpy.where(stats["valid"], stats["num_cells"], 0)}
+		for variable in VARIABLES:
+			slices[name][variable + "_mean"] = stats[variable + "_mean"]
+			slices[name][variable + "_var"] = stats[variable + "_var"]
+	return slices
+
+def read_slices_xls(filename): # embryo_slices from the slices.xls written by embryo_analysis.py
+	workbook = xlrd.open_workbook(filename, on_demand=True)
+	slices = {}
+	for sheet_name in workbook.sheet_names():
+		worksheet = workbook.sheet_by_name(sheet_name)
+		name = sheet_name.split(" ")[-1]	# "Region L"
+		num_slices = worksheet.nrows - 1
+		columns = {"num_cells": numpy.zeros(num_slices, dtype=int)}
+		for key in ["her1_bgN_mean", "her1_bgN_var", "her7_bgN_mean", "her7_bgN_var"]:
+			columns[key] = numpy.full(num_slices, numpy.nan)
+		for i in range(num_slices):
+			row = worksheet.row_values(i + 1, 0, 8)
+			if len(row) < 8 or not shared.isFloat(row[1]):	# "Too few cells to analyze"
+				continue
+			columns["num_cells"][i] = int(row[1])
+			columns["her1_bgN_mean"][i], columns["her1_bgN_var"][i] = row[2], row[3]
+			columns["her7_bgN_mean"][i], columns["her7_bgN_var"][i] = row[5], row[6]
+		slices[name] = columns
+	workbook.release_resources()
+	return slices
+
+def table_slices(columns): # embryo_slices from the columns of a slices table written by writers.py
+	slices = {}
+	regions = numpy.asarray(columns["region"]).astype(str)
+	for name in numpy.unique(regions):
+		rows = numpy.flatnonzero(regions == name)
+		rows = rows[numpy.argsort(numpy.asarray(columns["slice"], dtype=int)[rows], kind='stable')]
+		valid = numpy.asarray(columns["valid"], dtype=int)[rows] == 1
+		slices[str(name)] = {"num_cells": numpy.where(valid, numpy.asarray(columns["num_cells"], dtype=int)[rows], 0)}
+		for variable in VARIABLES:
+			for statistic in ["_mean", "_var"]:
+				slices[str(name)][variable + statistic] = numpy.asarray(columns[variable + statistic], dtype=float)[rows]
+	return slices
+
+def read_slices(directory): # embryo_slices from an embryo output directory, in whichever format it was written
+	if os.path.isfile(directory + "/slices.npz"):
+		with numpy.load(directory + "/slices.npz") as data:
+			return table_slices(dict(data))
+	if os.path.isfile(directory + "/slices.csv"):
+		with open(directory + "/slices.csv", newline="") as f:
+			rows = list(csv.DictReader(f))
+		columns = {}
+		for key in ["region", "slice", "num_cells", "valid"] + [v + s for v in VARIABLES for s in ["_mean", "_var"]]:
+			columns[key] = [row[key] for row in rows]
+		for key in columns:
+			if key != "region":
+				columns[key] = [float(value) if value != "" else numpy.nan for value in columns[key]]
+		return table_slices(columns)
+	return read_slices_xls(directory + "/slices.xls")
+
+def resized(moments, num_slices): # moments padded with empty slices up to num_slices along the last axis
+	extra = num_slices - moments.count.shape[-1]
+	if extra <= 0:
+		return moments
+	padding = [(0, 0)] * (moments.count.ndim - 1) + [(0, extra)]
+	grown = Moments(moments.count.shape[:-1] + (num_slices,))
+	grown.count = numpy.pad(moments.count, padding)
+	grown.mean = numpy.pad(moments.mean, padding)
+	grown.m2 = numpy.pad(moments.m2, padding)
+	return grown
+
+def padded(values, num_slices, empty): # values padded with empty slices up to num_slices along the last axis
+	extra = num_slices - values.shape[-1]
+	if extra <= 0:
+		return values
+	return numpy.pad(values, [(0, 0)] * (values.ndim - 1) + [(0, extra)], constant_values=empty)
+
+class SliceProfiles: # streaming pooled slice statistics of many embryos; add() one embryo at a time, merge() partial results
+	# For every region and slice position, per variable (rows of the Moments in VARIABLES order):
+	#   pooled: the cells of all embryos pooled together (merged from each embryo's slice count, mean and variance)
+	#   embryo_mean, embryo_var: spread over embryos of the slice mean and variance, every embryo weighing the same
+	#   normalized_mean, normalized_var: as embryo_mean and embryo_var, after dividing each embryo's profile by the mean
+	#     (or variance) of all the cells in the embryo's region
+	# Slices with fewer than 3 cells are left out, as in slices.xls.
+	def __init__(self):
+		self.num_embryos = 0
+		self.moments = {}	# (region, kind) -> Moments of shape (len(VARIABLES), slices)
+
+	def accumulator(self, name, kind, num_slices):
+		key = (name, kind)
+		if key not in self.moments:
+			self.moments[key] = Moments((len(VARIABLES), 0))
+		self.moments[key] = resized(self.moments[key], num_slices)
+		return self.moments[key]
+
+	def add(self, slices): # slices: region -> per-slice statistics of one embryo, see embryo_slices
+		self.num_embryos += 1
+		for name in slices:
+			columns = slices[name]
+			# Embryos differ in their number of slices: pad this embryo, or the accumulators, with empty slices to the wider one
+			num_slices = max(len(columns["num_cells"]), self.accumulator(name, "pooled", 0).count.shape[-1])
+			count = padded(numpy.asarray(columns["num_cells"], dtype=float), num_slices, 0)
+			means = padded(numpy.array([columns[v + "_mean"] for v in VARIABLES], dtype=float), num_slices, numpy.nan)
+			variances = padded(numpy.array([columns[v + "_var"] for v in VARIABLES], dtype=float), num_slices, numpy.nan)
+			used = (count > 0) & ~numpy.isnan(means).any(axis=0) & ~numpy.isnan(variances).any(axis=0)
+			means = numpy.where(used, means, numpy.nan)
+			variances = numpy.where(used, variances, numpy.nan)
+			counts = numpy.where(used, count, 0) * numpy.ones((len(VARIABLES), 1))
+
+			# Cells of all embryos: merge this embryo's slices as precomputed groups
+			self.accumulator(name, "pooled", num_slices).combine(counts, numpy.nan_to_num(means), numpy.nan_to_num(variances) * counts)
+
+			# Embryos as samples: one value per slice and embryo, NaN for unused slices
+			self.accumulator(name, "embryo_mean", num_slices).add(means[None])
+			self.accumulator(name, "embryo_var", num_slices).add(variances[None])
+
+			# Profiles relative to the whole region of this embryo
+			total = counts.sum(axis=1)
+			with numpy.errstate(invalid='ignore', divide='ignore'):
+				region_mean = numpy.nansum(counts * means, axis=1) / total
+				region_var = numpy.nansum(counts * (variances + (means - region_mean[:, None]) ** 2), axis=1) / total
+				normalized_mean = means / region_mean[:, None]
+				normalized_var = variances / region_var[:, None]
+			self.accumulator(name, "normalized_mean", num_slices).add(normalized_mean[None])
+			self.accumulator(name, "normalized_var", num_slices).add(normalized_var[None])
+		return self
+
+	def merge(self, other):
+		self.num_embryos += other.num_embryos
+		for key in other.moments:
+			name, kind = key
+			num_slices = max(other.moments[key].count.shape[-1], self.accumulator(name, kind, 0).count.shape[-1])
+			self.accumulator(name, kind, num_slices).merge(resized(other.moments[key], num_slices))
+		return self
+
+	def profiles(self): # region -> columns of the pooled profile, one row per slice position
+		profiles = {}
+		for name in sorted(set(name for name, kind in self.moments)):
+			pooled = self.moments[(name, "pooled")]
+			num_slices = pooled.count.shape[-1]
+			columns = {"region": numpy.full(num_slices, name), "slice": numpy.arange(1, num_slices + 1)}
+			columns["num_embryos"] = self.moments[(name, "embryo_mean")].count[0].astype(int)
+			columns["num_cells"] = pooled.count[0].astype(int)
+			for i, variable in enumerate(VARIABLES):
+				columns[variable + "_pooled_mean"] = numpy.where(pooled.count[i] > 0, pooled.mean[i], numpy.nan)
+				columns[variable + "_pooled_var"] = pooled.var[i]
+				for kind in ["embryo_mean", "embryo_var", "normalized_mean", "normalized_var"]:
+					moments = resized(self.moments[(name, kind)], num_slices)
+					columns[variable + "_" + kind] = numpy.where(moments.count[i] > 0, moments.mean[i], numpy.nan)
+					columns[variable + "_" + kind + "_sd"] = moments.std[i]	# spread over embryos
+			profiles[name] = columns
+		return profiles
+
+def write_profiles(filename, profiles): # long-form table of SliceProfiles.profiles(), one row per region and slice
+	with open(filename, "w", newline="") as f:
+		writer = csv.writer(f)
+		header = None
+		for name in profiles:
+			columns = profiles[name]
+			if header is None:
+				header = list(columns)
+				writer.writerow(header)
+			writer.writerows(zip(*[columns[key].tolist() for key in header]))
+
+def combine_directories(directories): # SliceProfiles of the embryo output directories, reading one embryo at a time
+	profiles = SliceProfiles()
+	for directory in directories:
+		profiles.add(read_slices(directory))
+	return profiles
+
+def main():
+	args = sys.argv[1:]
+	if len(args) < 3 or (args[0] != '-o' and args[0] != '--output-file'):
+		usage()
+	write_profiles(args[1], combine_directories(args[2:]).profiles())
+
+def usage():
+	print("combine.py: Invalid command-line arguments.")
+	print("Format: python combine.py -o <output .csv file> <embryo output directory> [<embryo output directory> ...]")
+	print("Each directory must contain the slices.xls, slices.csv or slices.npz written by embryo_analysis.py.")
+	exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -15,36 +15,259 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-import sys, shared, os
-import matplotlib.pyplot as plt
+import sys, shared, os, hashlib
 import numpy, math
 import xlrd, xlwt
 from regions import Region
+import writers, plotting, timing, heatmap
+from cells import CellTable, Cell, UNSPLIT, LEFT, RIGHT
 from xlrd import XLRDError
 
-class Cell: # store the position and two expression levels for a cell
-	def __init__(self, xpos, ypos, zpos, her1, her7, CB, YB):
-		self.xpos = -xpos
-		self.ypos = ypos
-		self.zpos = zpos
-		self.her1 = her1
-		self.her7 = her7
-		self.her1_bgN = her1 - CB	# Background normalization for her1 count
-		self.her7_bgN = her7 - YB	# Background normalization for her7 count
-
-def middle_splitting(cell_list): # split middle section into left(upper) and right(lower) sections
-	ys = []
-	for i in range(len(cell_list)):
-		ys.append(cell_list[i].ypos)
+def read_section_block(worksheet, first, numeric_x): # read the six columns (ID, x, y, z, her1, her7) of a section block in bulk
+	# Rows hold a cell if the ID column is not blank and, if numeric_x is set, the x column is a number
+	ids = numpy.array(worksheet.col_values(first, start_rowx=1), dtype=object)
+	keep = ids != ''
+	if numeric_x:
+		types = numpy.array(worksheet.col_types(first+1, start_rowx=1))
+		keep &= (types == xlrd.XL_CELL_NUMBER) | (types == xlrd.XL_CELL_DATE)
+	values = []	# x, y, z, her1 and her7 of the rows holding a cell
+	for k in range(1, 6):
+		values.append(numpy.array(worksheet.col_values(first+k, start_rowx=1), dtype=object)[keep].astype(float))
+	return keep, values
+
+def middle_splitting(cells, index): # split middle section into left(upper) and right(lower) sections
+	ys = cells.y[index]
 	middle = (max(ys)+min(ys))/2
-	upper = []
-	lower = []
-	for cell in cell_list:
-		if cell.ypos >= middle:
-			upper.append(cell)
-		else: 
-			lower.append(cell)
-	return (upper, lower)
+	upper = ys >= middle
+	return (index[upper], index[~upper])
+
+def tracked_extreme(values, smaller): # min (smaller=True) or max of values in reading order, where 0 means "not set yet" as in the input loop
+	if not numpy.any(values == 0):
+		if len(values) == 0:
+			return 0
+		return values.min() if smaller else values.max()
+	extreme = 0
+	for value in values.tolist():
+		if extreme == 0 or (extreme > value if smaller else extreme < value):
+			extreme = value
+	return extreme
+
+def section_blocks(num_sec, in_format, wholePSM = False, ly_shift = 0, middle = 0): # six-column section blocks of an input worksheet, as (first column, section, side, y shift)
+	if wholePSM:	# If image is lateral view, without left/right partition
+		blocks = [(i*6, 0, LEFT, ly_shift) for i in range(num_sec)]
+	elif in_format: # given data is already split in half and shifted, left and right blocks alternate
+		blocks = [(i*6, int(i/2), LEFT if i%2 == 0 else RIGHT, ly_shift if i%2 == 0 else 0) for i in range(num_sec * 2)]
+		if middle!=0:
+			blocks.append((num_sec*12, num_sec, LEFT, ly_shift))	# side is set by middle_splitting
+	else: # given data will be split in half and shifted by shift_and_split
+		blocks = [(i*6, i, UNSPLIT, 0) for i in range(num_sec)]
+	return blocks
+
+def block_cells(blocks, block_values, num_rows, num_sec, in_format, CB = 0.0, YB = 0.0): # CellTable of the cells read from section blocks
+	# block_values: (keep, [x, y, z, her1, her7]) of every block, as read_section_block returns them for num_rows worksheet rows
+	# Put the data into (row, block) matrices, so cells keep the row by row reading order
+	keep = numpy.zeros((num_rows, len(blocks)), dtype=bool)
+	columns = [numpy.zeros((num_rows, len(blocks))) for k in range(5)]	# x, y, z, her1 and her7
+	sections = numpy.zeros((num_rows, len(blocks)), dtype=int)
+	sides = numpy.zeros((num_rows, len(blocks)), dtype=numpy.int8)
+	for b in range(len(blocks)):
+		first, section, side, y_shift = blocks[b]
+		keep[:, b], values = block_values[b]
+		if y_shift != 0:
+			values[1] = values[1] + y_shift
+		for k in range(5):
+			columns[k][keep[:, b], b] = values[k]
+		sections[:, b] = section
+		sides[:, b] = side
+	cells = CellTable(-columns[0][keep], columns[1][keep], columns[2][keep], columns[3][keep], columns[4][keep], sections[keep], sides[keep], CB, YB, num_sec)	# x positions are mirrored
+
+	# Middle section cells are kept as an extra section after the last one, which the regions do not use
+	middle_index = numpy.flatnonzero(cells.section == num_sec)
+	if in_format and len(middle_index)>0:
+		upper, lower = middle_splitting(cells, middle_index)
+		cells.side[upper] = LEFT
+		cells.side[lower] = RIGHT
+	return cells
+
+def read_cells(filename, num_sec, in_format, wholePSM = False, ly_shift = 0, middle = 0, CB = 0.0, YB = 0.0): # read the cells of the first worksheet into a CellTable
+	workbook = xlrd.open_workbook(filename, on_demand=True)	# only load the sheet we read
+	worksheet = workbook.sheet_by_index(0)	# read the first worksheet only
+	blocks = section_blocks(num_sec, in_format, wholePSM, ly_shift, middle)
+	num_rows = max(worksheet.nrows - 1, 0)
+	block_values = [read_section_block(worksheet, first, wholePSM or in_format) for first, section, side, y_shift in blocks]
+	workbook.release_resources()
+	return block_cells(blocks, block_values, num_rows, num_sec, in_format, CB, YB)
+
+CACHE_VERSION = 1	# bump when read_cells or the cache layout changes, so old sidecar files are parsed again
+
+def cache_file(filename, num_sec, in_format, wholePSM = False, ly_shift = 0, middle = 0): # sidecar cache file of a workbook for the given parse options
+	options = repr((CACHE_VERSION, int(num_sec), bool(in_format), bool(wholePSM), float(ly_shift), int(middle)))
+	return filename + "." + hashlib.sha1(options.encode()).hexdigest()[:12] + ".cells.npz"
+
+def file_hash(filename): # sha1 of the file contents
+	digest = hashlib.sha1()
+	with open(filename, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			digest.update(block)
+	return digest.hexdigest()
+
+def load_cells(filename, num_sec, in_format, wholePSM = False, ly_shift = 0, middle = 0, CB = 0.0, YB = 0.0): # read_cells, reusing the parsed cells saved next to the workbook while its contents do not change
+	sidecar = cache_file(filename, num_sec, in_format, wholePSM, ly_shift, middle)
+	content_hash = file_hash(filename)
+	if os.path.isfile(sidecar):
+		try:
+			with numpy.load(sidecar) as data:
+				if str(data["content_hash"]) == content_hash:
+					return CellTable(data["x"], data["y"], data["z"], data["her1"], data["her7"], data["section"], data["side"], CB, YB, num_sec)
+		except (IOError, ValueError, KeyError):	# unreadable or old cache file, parse the workbook again
+			pass
+	cells = read_cells(filename, num_sec, in_format, wholePSM, ly_shift, middle, CB, YB)
+	try:	# write to a temporary file first so concurrent runs never see a partial cache file
+		temp_file = sidecar[:-len(".npz")] + "." + str(os.getpid()) + ".tmp.npz"
+		numpy.savez(temp_file, content_hash=content_hash, x=cells.x, y=cells.y, z=cells.z, her1=cells.her1, her7=cells.her7, section=cells.section, side=cells.side)
+		os.replace(temp_file, sidecar)
+	except OSError:	# input directory is not writable, run without cache
+		pass
+	return cells
+
+def shift_and_split(cells, lr_shift = 0): # shift the sections of unsplit data (input format 0) to their positions and split them into left and right
+	num_sec = cells.num_sec
+	xs = cells.x.copy()
+	raw_xs = -cells.x	# section extents are measured on the x positions as given in the input file
+	section_xmin = [tracked_extreme(raw_xs[cells.section == i], True) for i in range(num_sec)]
+	section_xmax = [tracked_extreme(raw_xs[cells.section == i], False) for i in range(num_sec)]
+	ymin = tracked_extreme(cells.y, True)
+	ymax = tracked_extreme(cells.y, False)
+	
+	# Shift sections to correct positions
+	shift = 0
+	for i in range(num_sec-1,0,-1):
+		shift += section_xmax[i]-section_xmin[i-1] + 0.01
+		xs[cells.section == i-1] += shift
+
+	# Split sections into left and right
+	split_threshold = (ymax+ymin)/2 + lr_shift # shift the threshold up or down (left or right)
+	side = numpy.where(cells.y > split_threshold, LEFT, RIGHT)
+	return CellTable(xs, cells.y, cells.z, cells.her1, cells.her7, cells.section, side, cells.CB, cells.YB, num_sec)
+
+def prepare_cells(cells, CB = None, YB = None, lr_shift = 0): # apply background means and split unsplit data, the parameter independent part of analyze_embryo
+	if CB is not None or YB is not None:
+		cells = cells.with_background(cells.CB if CB is None else CB, cells.YB if YB is None else YB)
+	if numpy.any(cells.side[cells.section < cells.num_sec] == UNSPLIT):
+		cells = shift_and_split(cells, lr_shift)
+	return cells
+
+class EmbryoAnalysis: # in-memory results of analyze_embryo
+	def __init__(self, cells, regions):
+		self.cells = cells	# CellTable after section shifting and left/right split
+		self.regions = regions	# "L" and "R" regions ("L" only for lateral view images)
+		self.slice_stats = {}	# region name -> per-slice statistics, see Region.slice_statistics
+		for region in regions:
+			self.slice_stats[region.name] = region.slice_statistics()
+
+def analyze_embryo(cells, angle, delta_angle, CB = None, YB = None, lr_shift = 0, L_angle = None, R_angle = None, slice_width = 8, recorder = timing.NULL,
+	resample = None, replicates = 1000, confidence = 0.95, seed = None): # slice the cells of one embryo, without reading or writing files
+	# cells: CellTable as returned by read_cells; unsplit data is shifted and split with lr_shift
+	# angle, delta_angle: initial slice angle and angle change rate (-a and -dA); L_angle/R_angle override the per-region angle
+	# CB, YB: background noise means (-m1 and -m7), replacing those stored in cells if given
+	# slice_width: width of a slice along the x axis
+	# recorder: timing.Recorder receiving the shift, geometry, slicing, statistics and intervals stages
+	# resample: "bootstrap" or "jackknife" to add confidence intervals to the slice statistics (see stats.slice_intervals),
+	#   with replicates bootstrap resamplings drawn from seed; None for no intervals
+	with recorder.stage("shift") as stage:
+		cells = prepare_cells(cells, CB, YB, lr_shift)
+		stage.count(cells=len(cells))
+	if L_angle is None:
+		L_angle = 180 - angle
+	if R_angle is None:
+		R_angle = 180 + angle
+	
+	regions = []
+	in_region = cells.section < cells.num_sec
+	if numpy.any(in_region & (cells.side == LEFT)):
+		regions.append(Region(cells.num_sec, cells, "L", L_angle, -delta_angle, numpy.flatnonzero(in_region & (cells.side == LEFT)), slice_width, recorder))	# angle decrease after every step in left PSM
+	if numpy.any(in_region & (cells.side == RIGHT)):
+		regions.append(Region(cells.num_sec, cells, "R", R_angle, delta_angle, numpy.flatnonzero(in_region & (cells.side == RIGHT)), slice_width, recorder))	# angle increase after every step in right PSM
+	if len(regions) == 0:
+		raise ValueError("embryo has no cells to analyze")
+	with recorder.stage("statistics") as stage:
+		analysis = EmbryoAnalysis(cells, regions)
+		stage.count(slices=sum(region.num_slices for region in regions))
+	if resample is not None:
+		with recorder.stage("intervals") as stage:
+			seeds = numpy.random.SeedSequence(seed).spawn(len(regions))	# one stream per region
+			for region, region_seed in zip(regions, seeds):
+				region.slice_intervals(resample, replicates, confidence, region_seed)
+			stage.count(slices=sum(region.num_slices for region in regions))
+	return analysis
+
+# Values of the plot option of write_results (-pl)
+NO_PLOT = 0	# no histogram
+PLOT_NOW = 1	# save the histogram counts and draw totalherhist.png
+PLOT_LATER = 2	# only save the histogram counts, for plotting.py to draw later
+
+def write_xls(directory, analysis): # write cells.xls, slices.xls and sliceInfo.xls
+	workbook = xlwt.Workbook(encoding="ascii")
+	for region in analysis.regions:
+		write_cells(directory, workbook, region)
+	workbook.save(directory + "/cells.xls")							
+	workbook = xlwt.Workbook(encoding="ascii")		
+	for region in analysis.regions:
+		analyze_slice(directory, workbook, region)
+	workbook.save(directory + "/slices.xls")	# Write background normalized her info for every slices, for downstream analysis
+	workbook = xlwt.Workbook(encoding="ascii")
+	for region in analysis.regions:
+		write_slice_info(directory, workbook, region)
+	workbook.save(directory + "/sliceInfo.xls")	# Write raw her count for every slice, for heatmap plotting and visualization purpose
+	if any(len(region.intervals) > 0 for region in analysis.regions):
+		workbook = xlwt.Workbook(encoding="ascii")
+		for region in analysis.regions:
+			write_intervals(workbook, region)
+		workbook.save(directory + "/intervals.xls")	# Confidence intervals of the slices.xls statistics
+
+def write_results(directory, analysis, plot = PLOT_NOW, output_format = "xls", recorder = timing.NULL): # write the slices of an EmbryoAnalysis in the given format, and the expression histogram
+	shared.ensureDir(directory)
+	if output_format != "xls" and output_format not in writers.BACKENDS:
+		raise ValueError("unknown output format " + str(output_format))
+	with recorder.stage("write") as stage:
+		if output_format == "xls":
+			write_xls(directory, analysis)
+		else:
+			writers.BACKENDS[output_format](directory, analysis.regions)
+		stage.count(cells=sum(len(region.index) for region in analysis.regions), slices=sum(region.num_slices for region in analysis.regions))
+		
+	# make histogram to view distribution of her1/her7 expression level
+	if plot != NO_PLOT:
+		with recorder.stage("plot") as stage:
+			cells = analysis.cells
+			index = numpy.flatnonzero(cells.section < cells.num_sec)
+			plother1her7(cells, index, directory, plot == PLOT_NOW)
+			stage.count(cells=len(index))
+
+def write_cells(directory, wb, region): # write the region boundaries and every cell of the region to cells.xls
+	worksheet = wb.add_sheet("Region " + region.name)	
+	
+	# Slice boundary data
+	labels = ["Top left xpos","Top right xpos","Top ypos","Bottom left xpos","Bottom right xpos","Bottom ypos","Slice width","# of slices"]
+	line = [region.slices[0].top_left_xpos, region.slices[-1].top_right_xpos, region.top.ypos,
+		region.slices[0].bottom_left_xpos, region.slices[-1].bottom_right_xpos, region.bottom.ypos,
+		region.slice_width, region.num_slices]		
+	for j in range(len(labels)):
+		worksheet.write(0, j, labels[j])
+		worksheet.write(1, j, line[j])
+				
+	labels = ["Cell xpos","Cell ypos","Her1 level","Her7 level"]
+	for j in range(len(labels)):
+		worksheet.write(3,j,labels[j])
+	xs = region.cells.x[region.index]
+	ys = region.cells.y[region.index]
+	her1 = region.cells.her1[region.index]
+	her7 = region.cells.her7[region.index]
+	for j in range(len(region.index)):
+		worksheet.write(j+4, 0, xs[j])
+		worksheet.write(j+4, 1, ys[j])
+		worksheet.write(j+4, 2, her1[j])
+		worksheet.write(j+4, 3, her7[j])
 
 def analyze_slice(directory, wb, region): # extract necessary data from each slice, writes the data to slices.xls	
 	# Set up the worksheet
@@ -55,35 +278,51 @@ def analyze_slice(directory, wb, region): # extract necessary data from each sli
 		ws.write(0,i,label=labels[i])
 		
 	# Extract necessary data from each slice 
+	stats = region.slice_statistics()
 	for i in range(region.num_slices):
 					
 		curr_slice = region.slices[i]	
 					 
-		# Ignore slices with fewer than 3 cells
-		if not curr_slice.identify_cells(region.cell_list):
+		# Ignore slices with fewer than 3 cells (cells are assigned to slices when the region is built)
+		if not curr_slice.valid:
 			ws.write(i+1, 0, i+1)
 			ws.write(i+1, 1, "Too few cells to analyze")
 			continue
 			
-		mean_her1 = curr_slice.slice_mean_her1_bgN()
-		mean_her7 = curr_slice.slice_mean_her7_bgN()
-		var_her1 = curr_slice.slice_variance_her1_bgN()
-		var_her7 = curr_slice.slice_variance_her7_bgN()
-		std_her1 = numpy.sqrt(curr_slice.slice_variance_her1_bgN()) 
-		std_her7 = numpy.sqrt(curr_slice.slice_variance_her7_bgN())	
-				
 		column_num = 0 
-		line = [i+1,curr_slice.num_keep_cells,mean_her1,var_her1,std_her1,mean_her7,var_her7,std_her7]
+		line = [i+1,curr_slice.num_keep_cells,stats["her1_bgN_mean"][i],stats["her1_bgN_var"][i],stats["her1_bgN_std"][i],stats["her7_bgN_mean"][i],stats["her7_bgN_var"][i],stats["her7_bgN_std"][i]]
 		while column_num < len(line):
 			ws.write(i+1, column_num, line[column_num])
 			column_num+=1
 		
 		# Write individual cell expression levels
+		her1_bgNlevels = curr_slice.her1_bgNlevels
+		her7_bgNlevels = curr_slice.her7_bgNlevels
 		for j in range(curr_slice.num_keep_cells):			
-			ws.write(i+1, column_num, curr_slice.her1_bgNlevels[j])
-			ws.write(i+1, column_num+1, curr_slice.her7_bgNlevels[j])
+			ws.write(i+1, column_num, her1_bgNlevels[j])
+			ws.write(i+1, column_num+1, her7_bgNlevels[j])
 			column_num+=2
 
+def write_intervals(wb, region): # write the slice means and variances of slices.xls with their confidence intervals to intervals.xls
+	ws = wb.add_sheet("Region " + region.name)
+	keys = [("her1_bgN_mean","Her1 mean"),("her1_bgN_var","Her1 variance"),("her7_bgN_mean","Her7 mean"),("her7_bgN_var","Her7 variance")]
+	labels = ["Slice #","# of cells"]
+	for key, label in keys:
+		labels += [label, label + " low", label + " high", label + " SE"]
+	for i in range(len(labels)):
+		ws.write(0,i,label=labels[i])
+	stats = region.slice_statistics()
+	for i in range(region.num_slices):
+		ws.write(i+1, 0, i+1)
+		if not stats["valid"][i]:
+			ws.write(i+1, 1, "Too few cells to analyze")
+			continue
+		line = [int(stats["num_cells"][i])]
+		for key, label in keys:
+			line += [stats[key][i], region.intervals[key + "_low"][i], region.intervals[key + "_high"][i], region.intervals[key + "_se"][i]]
+		for j in range(len(line)):
+			ws.write(i+1, j+1, line[j])
+
 def write_slice_info(directory, wb, region):  # Write slices info to 'sliceInfo.xls' for heatmap plotting purpose
 
 	ws_slices = wb.add_sheet("Slice " + region.name)
@@ -95,6 +334,7 @@ def write_slice_info(directory, wb, region):  # Write slices info to 'sliceInfo.
 	ws_slices.write(0,1,label="top")
 	ws_slices.write(0,2,label="bottom")
 
+	stats = region.slice_statistics()
 	for i in range(region.num_slices):					
 		curr_slice = region.slices[i]
 		
@@ -114,57 +354,47 @@ def write_slice_info(directory, wb, region):  # Write slices info to 'sliceInfo.
 			ws_slices.write(i+4, 6, "Too few cells to analyze")
 			continue
 		
-		ws_slices.write(i+4,6,curr_slice.slice_mean_her1())
-		ws_slices.write(i+4,7,curr_slice.slice_variance_her1())
-		ws_slices.write(i+4,8,numpy.sqrt(curr_slice.slice_variance_her1()) )
-		ws_slices.write(i+4,9,curr_slice.slice_mean_her7())
-		ws_slices.write(i+4,10,curr_slice.slice_variance_her7())
-		ws_slices.write(i+4,11,numpy.sqrt(curr_slice.slice_variance_her7()))
+		ws_slices.write(i+4,6,stats["her1_mean"][i])
+		ws_slices.write(i+4,7,stats["her1_var"][i])
+		ws_slices.write(i+4,8,stats["her1_std"][i])
+		ws_slices.write(i+4,9,stats["her7_mean"][i])
+		ws_slices.write(i+4,10,stats["her7_var"][i])
+		ws_slices.write(i+4,11,stats["her7_std"][i])
 		
 		column_num = 12
 		# Write individual cell expression levels
+		her1_levels = curr_slice.her1_levels
+		her7_levels = curr_slice.her7_levels
 		for j in range(curr_slice.num_cells):
-			ws_slices.write(i+4, column_num, curr_slice.her1_levels[j])
-			ws_slices.write(i+4, column_num+1, curr_slice.her7_levels[j])
+			ws_slices.write(i+4, column_num, her1_levels[j])
+			ws_slices.write(i+4, column_num+1, her7_levels[j])
 			column_num+=2
 	
-def plother1her7(cell_lists, directory):
-	her1 = []
-	her7 = []
-	her = []
-	for i in range(len(cell_lists)):
-		for j in range(len(cell_lists[i])):
-			her1.append(cell_lists[i][j].her1)
-			her7.append(cell_lists[i][j].her7)
-			her.append(cell_lists[i][j].her1 + cell_lists[i][j].her7)
-
-	# Plot her1 & her7 expression distribution
-	plt.subplot(211)
-	plt.hist(her7, 50, normed=1, facecolor='lightblue', alpha=1.0, label='her7')
-	plt.hist(her1, 50, normed=1, facecolor='orange', alpha=0.5, label='her1')
-	plt.legend()
-	plt.tick_params(direction='in')
-	plt.ylabel('Frequency')
-	#plt.xlabel('mRNA expression level')
-	#plt.savefig(directory + "/her1her7hist.png", format = "png")
-
-	# Plot total her expression distribution
-	plt.subplot(212)
-	plt.hist(her, 50, normed=1, facecolor='orange', alpha=1.0, label='Total her')	
-	plt.legend()
-	plt.tick_params(direction='in')
-	plt.ylabel('Frequency')
-	plt.xlabel('mRNA expression level')
-	plt.savefig(directory + "/totalherhist.png", format = "png", dpi=300)
+def plother1her7(cells, index, directory, render = True): # save the expression histograms of the cells at the given rows, and plot them if render is set
+	her1 = cells.her1[index]
+	her7 = cells.her7[index]
+	hist = plotting.histogram_counts(her1, her7)
+	plotting.save_histograms(directory, hist)	# lets plotting.py draw the plot later
+	if render:
+		plotting.plot_histograms(directory, hist)
 		
-def main():
-	args = sys.argv[1:]
+def main(args = None): # args: command-line arguments without the program name, sys.argv[1:] by default; returns the EmbryoAnalysis
+	if args is None:
+		args = sys.argv[1:]
 	num_args = len(args)
 	req_args = [False] * 8
 	lr_shift = 0
 	ly_shift = 0
 	middle = 0
 	wholePSM = False
+	cache = False
+	output_format = "xls"
+	plot = PLOT_NOW
+	timed = 0
+	resolutions = []
+	resample = None
+	replicates = 1000
+	seed = None
 	if num_args >= 16:
 		for arg in range(0, num_args - 1, 2):
 			option = args[arg]
@@ -180,12 +410,12 @@ def main():
 				directory = value
 				req_args[1] = True
 			elif (option == '-a' or option == '--initial-angle') and shared.isFloat(value):	# y-intercept from angle measurement equation
-				L_angle = 180 - float(value)
-				R_angle = 180 + float(value)
+				angle = float(value)
+				L_angle = 180 - angle
+				R_angle = 180 + angle
 				req_args[2] = True
 			elif (option == '-dA' or option == '--delta-angle') and shared.isFloat(value): # Slope from angle measurement equation, use 0.0 for fix angle
-				L_delta_angle = -float(value)	# angle decrease after every step in left PSM
-				R_delta_angle = float(value)	# angle increase after every step in right PSM
+				delta_angle = float(value)	# angle decreases by delta_angle after every step in left PSM and increases in right PSM
 				req_args[3] = True
 			elif (option == '-n' or option == '--num-sec') and shared.isInt(value):
 				num_sec = int(value)
@@ -215,6 +445,28 @@ def main():
 			# (Optional) Number of middle sections if they exist (wildtype only)
 			elif (option == '-m' or option == '--middle-section') and shared.isInt(value):
 				middle = int(value)
+			# (Optional) Cache the parsed input next to the input file and reuse it while the file does not change
+			elif (option == '-c' or option == '--cache') and shared.isInt(value):
+				cache = int(value)==1
+			# (Optional) Output format: xls (default, Excel sheets), or csv, npz or parquet for long-form tables
+			elif (option == '-o' or option == '--output-format') and writers.available(value):
+				output_format = value
+			# (Optional) 0 for no histogram, 1 to plot it (default), 2 to only save the histogram counts for plotting.py
+			elif (option == '-pl' or option == '--plot') and shared.isInt(value) and int(value) in [NO_PLOT, PLOT_NOW, PLOT_LATER]:
+				plot = int(value)
+			# (Optional) Comma separated pixel sizes of slice heatmaps to rasterize, drawn unless -pl is 0 or 2
+			elif (option == '-hm' or option == '--heatmap') and all(shared.isFloat(v) and float(v) > 0 for v in value.split(',')):
+				resolutions = [float(v) for v in value.split(',')]
+			# (Optional) Confidence intervals of the slice means and variances, by bootstrap or jackknife resampling of the cells
+			elif (option == '-ci' or option == '--intervals') and value in ["bootstrap", "jackknife"]:
+				resample = value
+			elif (option == '-br' or option == '--replicates') and shared.isInt(value) and int(value) > 0:
+				replicates = int(value)
+			elif (option == '-seed' or option == '--seed') and shared.isInt(value):
+				seed = int(value)
+			# (Optional) 1 to write the time, CPU time, peak memory and item counts of every stage to timing.json, 2 to also trace the peak memory of every stage
+			elif (option == '-t' or option == '--timing') and shared.isInt(value) and int(value) in [0, 1, 2]:
+				timed = int(value)
 			# (Optional) Value for left angle - use only if left and right initiate angle is different
 			elif (option == '-l' or option == '--l-angle') and shared.isFloat(value):
 				L_angle = float(value)
@@ -232,175 +484,31 @@ def main():
 		usage()
 
 	
-	shared.ensureDir(directory)
-
-	# Open the input file
-	workbook = xlrd.open_workbook(filename,'r')
-	worksheets = workbook.sheet_names()
-
-	# Iterate over each worksheet in a workbook
-	for worksheet_name in worksheets:
-        
-		worksheet = workbook.sheet_by_name(worksheet_name)
-		file_len = worksheet.nrows
-		
-		cell_lists = []
-		left_cell_lists = []
-		right_cell_lists = []
-		middle_cell_lists = []
-		section_xmin = [0] * num_sec
-		section_xmax = [0] * num_sec
-		ymin = 0
-		ymax = 0
-
-		if wholePSM:	# If image is lateral view, without left/right partition
-			print(filename)
-			cell_lists.append([])
-			for j in range(1,file_len):
-				row = list(worksheet.row(j))
-				for i in range(num_sec):
-					if row[i*6].value != '' and isinstance(row[i*6+1].value,float):
-						curr_cell = Cell(row[i*6+1].value, row[i*6+2].value+ly_shift, row[i*6+3].value, row[i*6+4].value, row[i*6+5].value, CB, YB)	
-						cell_lists[0].append(curr_cell)
-			
-			regions = [Region(num_sec, cell_lists, "L", L_angle, L_delta_angle)]
-
-			workbook = xlwt.Workbook(encoding="ascii")
-			for i in range(len(regions)):
-				worksheet = workbook.add_sheet("Region " + regions[i].name)	
-				
-				# Slice boundary data
-				labels = ["Top left xpos","Top right xpos","Top ypos","Bottom left xpos","Bottom right xpos","Bottom ypos","Slice width","# of slices"]
-				line = [regions[i].slices[0].top_left_xpos, regions[i].slices[-1].top_right_xpos, regions[i].top.ypos,
-					regions[i].slices[0].bottom_left_xpos, regions[i].slices[-1].bottom_right_xpos, regions[i].bottom.ypos,
-					regions[i].slice_width, regions[i].num_slices]		
-				for j in range(len(labels)):
-					worksheet.write(0, j, labels[j])
-					worksheet.write(1, j, line[j])
-							
-				labels = ["Cell xpos","Cell ypos","Her1 level","Her7 level"]
-				for j in range(len(labels)):
-					worksheet.write(3,j,labels[j])
-				for j in range(len(regions[i].cell_list)):
-					worksheet.write(j+4, 0, regions[i].cell_list[j].xpos)
-					worksheet.write(j+4, 1, regions[i].cell_list[j].ypos)
-					worksheet.write(j+4, 2, regions[i].cell_list[j].her1)
-					worksheet.write(j+4, 3, regions[i].cell_list[j].her7)
-											
-			workbook.save(directory + "/cells.xls")							
-			workbook = xlwt.Workbook(encoding="ascii")		
-			analyze_slice(directory, workbook, regions[0])
-			workbook.save(directory + "/slices.xls")	# Write background normalized her info for every slices, for downstream analysis
-			workbook = xlwt.Workbook(encoding="ascii")
-			write_slice_info(directory, workbook, regions[0])
-			workbook.save(directory + "/sliceInfo.xls")	# Write raw her count for every slice, for heatmap plotting and visualization purpose
-		
-		else:		# If image is in superior view, with left/right partition
-				
-			# Initialize the lists holding each section's list of cells
-			for i in range(num_sec):
-				cell_lists.append([])	
-				left_cell_lists.append([])
-				right_cell_lists.append([])
-			
-			# Put the data coming from the files to the matrix
-			for j in range(1, file_len):
-				row = list(worksheet.row(j))
-				
-				if in_format: # given data is already split in half and shifted
-					for i in range(num_sec * 2):
-						if row[i*6].value != '' and isinstance(row[i*6+1].value,float):
-							cur_i = int(i/2)
-							if i%2 == 0:
-								curr_cell = Cell(row[i*6+1].value, row[i*6+2].value+ly_shift, row[i*6+3].value, row[i*6+4].value, row[i*6+5].value, CB, YB)	
-								left_cell_lists[cur_i].append(curr_cell)
-							else:
-								curr_cell = Cell(row[i*6+1].value, row[i*6+2].value, row[i*6+3].value, row[i*6+4].value, row[i*6+5].value, CB, YB)	
-								right_cell_lists[cur_i].append(curr_cell)
-							cell_lists[cur_i].append(curr_cell)
-					
-					if middle!=0 and row[num_sec*2*6] != '' and isinstance(row[num_sec*2*6+1].value,float):
-						curr_cell = Cell(row[num_sec*12+1].value, row[num_sec*12+2].value+ly_shift, row[num_sec*12+3].value, row[num_sec*12+4].value, row[num_sec*12+5].value, CB, YB)	
-						middle_cell_lists.append(curr_cell)
-				
-				else: # given data will be split in half and shifted later			
-					for i in range(num_sec):
-						if row[i*6].value != '':
-							curr_cell = Cell(row[i*6+1].value, row[i*6+2].value, row[i*6+3].value, row[i*6+4].value, row[i*6+5].value, CB, YB)
-							cell_lists[i].append(curr_cell)
-							if section_xmin[i] == 0 or section_xmin[i] > row[i*6+1].value:
-								section_xmin[i] = row[i*6+1].value
-							if section_xmax[i] == 0 or section_xmax[i] < row[i*6+1].value:
-								section_xmax[i] = row[i*6+1].value
-							if ymin == 0 or ymin > row[i*6+2].value:
-								ymin = row[i*6+2].value
-							if ymax == 0 or ymax < row[i*6+2].value:
-								ymax = row[i*6+2].value
-
-			if in_format and len(middle_cell_lists)>0:
-				upper, lower = middle_splitting(middle_cell_lists)
-				left_cell_lists.append(upper)
-				right_cell_lists.append(lower)
-								
-			if not in_format:
-				# Shift sections to correct positions
-				shift = 0
-				for i in range(num_sec-1,0,-1):
-					shift += section_xmax[i]-section_xmin[i-1] + 0.01
-					for j in range(len(cell_lists[i-1])):
-						cell_lists[i-1][j].xpos += shift
-
-				# Split sections into left and right
-				split_threshold = (ymax+ymin)/2 + lr_shift # shift the threshold up or down (left or right)
-				for i in range(num_sec):
-					for j in range(len(cell_lists[i])):
-						if cell_lists[i][j].ypos > split_threshold:
-							left_cell_lists[i].append(cell_lists[i][j])
-						else:
-							right_cell_lists[i].append(cell_lists[i][j])
-
-			regions = [Region(num_sec, left_cell_lists, "L", L_angle, L_delta_angle), Region(num_sec, right_cell_lists, "R", R_angle, R_delta_angle)]
-			
-			workbook = xlwt.Workbook(encoding="ascii")
-			for i in range(len(regions)):
-				worksheet = workbook.add_sheet("Region " + regions[i].name)	
-				
-				# Slice boundary data
-				labels = ["Top left xpos","Top right xpos","Top ypos","Bottom left xpos","Bottom right xpos","Bottom ypos","Slice width","# of slices"]
-				line = [regions[i].slices[0].top_left_xpos, regions[i].slices[-1].top_right_xpos, regions[i].top.ypos,
-					regions[i].slices[0].bottom_left_xpos, regions[i].slices[-1].bottom_right_xpos, regions[i].bottom.ypos,
-					regions[i].slice_width, regions[i].num_slices]		
-				for j in range(len(labels)):
-					worksheet.write(0, j, labels[j])
-					worksheet.write(1, j, line[j])
-							
-				labels = ["Cell xpos","Cell ypos","Her1 level","Her7 level"]
-				for j in range(len(labels)):
-					worksheet.write(3,j,labels[j])
-				for j in range(len(regions[i].cell_list)):
-					worksheet.write(j+4, 0, regions[i].cell_list[j].xpos)
-					worksheet.write(j+4, 1, regions[i].cell_list[j].ypos)
-					worksheet.write(j+4, 2, regions[i].cell_list[j].her1)
-					worksheet.write(j+4, 3, regions[i].cell_list[j].her7)
-											
-			workbook.save(directory + "/cells.xls")							
-			workbook = xlwt.Workbook(encoding="ascii")		
-			analyze_slice(directory, workbook, regions[0])
-			analyze_slice(directory, workbook, regions[1])
-			workbook.save(directory + "/slices.xls")	# Write background normalized her info for every slices, for downstream analysis
-			workbook = xlwt.Workbook(encoding="ascii")
-			write_slice_info(directory, workbook, regions[0])
-			write_slice_info(directory, workbook, regions[1])
-			workbook.save(directory + "/sliceInfo.xls")	# Write raw her count for every slice, for heatmap plotting and visualization purpose
-			
-		# make histogram to view distribution of her1/her7 expression level
-		plother1her7(cell_lists,directory)
-		break # force the for loop to run only once (read the first worksheet only)
+	if wholePSM:
+		print(filename)
+	recorder = timing.Recorder(filename, timed == 2) if timed else timing.NULL
+	with recorder.stage("parse") as stage:
+		if cache:
+			cells = load_cells(filename, num_sec, in_format, wholePSM, ly_shift, middle, CB, YB)
+		else:
+			cells = read_cells(filename, num_sec, in_format, wholePSM, ly_shift, middle, CB, YB)
+		stage.count(cells=len(cells))
+	analysis = analyze_embryo(cells, angle, delta_angle, lr_shift=lr_shift, L_angle=L_angle, R_angle=R_angle, recorder=recorder,
+		resample=resample, replicates=replicates, seed=seed)
+	write_results(directory, analysis, plot, output_format, recorder)
+	if len(resolutions) > 0:
+		with recorder.stage("heatmap") as stage:
+			heatmap.write_heatmaps(directory, analysis, resolutions, plot == PLOT_NOW)
+			stage.count(slices=sum(region.num_slices for region in analysis.regions))
+	if timed:
+		recorder.save(directory + "/" + timing.TIMING)
+	return analysis
 
 def usage():
 	print("embryo_analysis.py: Invalid command-line arguments.")
-	print("Format: python embryo_analysis.py -i <input Excel file> -d <output directory> -a <initial angle from posterior> -dA <angle change rate> -n <number of sections> -m1 <background-noise-mean-her1> -m7 <background-noise-mean-her7> -f <0 or 1 to specify input format> -s <optional:half threshold shift> -l <optional:angle for left PSM> -r <optional:angle for right PSM>")
+	print("Format: python embryo_analysis.py -i <input Excel file> -d <output directory> -a <initial angle from posterior> -dA <angle change rate> -n <number of sections> -m1 <background-noise-mean-her1> -m7 <background-noise-mean-her7> -f <0 or 1 to specify input format> -s <optional:half threshold shift> -c <optional:1 to cache the parsed input file> -o <optional:output format, xls, csv, npz or parquet (needs pyarrow)> -pl <optional:0 no histogram, 1 plot, 2 save counts only> -hm <optional:comma separated heatmap pixel sizes> -ci <optional:bootstrap or jackknife confidence intervals> -br <optional:bootstrap replicates, default 1000> -seed <optional:random seed> -t <optional:1 to write timing.json, 2 to also trace memory> -l <optional:angle for left PSM> -r <optional:angle for right PSM>")
 	print("Example: python embryo_analysis.py -i wildtypefulldataset/WT1.xlsx -d wildtypefulldataset/embryo1 -a 44.23 -dA 0.039 -n 6 -m1 0.019 -m2 0.076 -f 0 -s -20")
 	exit(1)
 
-main()
+if __name__ == "__main__":
+	main()
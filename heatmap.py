@@ -0,0 +1,183 @@
+"""
+Rasterize the slices of a region into per-pixel slice labels, and fill them with slice statistics or cell levels for heatmaps
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys, math
+import numpy
+import shared, plotting
+
+STATISTICS = ["her1_bgN_mean", "her1_bgN_var", "her7_bgN_mean", "her7_bgN_var"]	# slice statistics drawn by default
+LEVELS = ["her1", "her7", "her1_bgN", "her7_bgN"]	# per-cell levels that can be drawn
+
+def resolution_name(resolution): # pixel size as written in file names, 1 and 1.0 alike
+	return "%g" % float(resolution) if shared.isFloat(resolution) else str(resolution)
+
+def heatmap_file(resolution): # file of the heatmaps of an embryo output directory at the given pixel size
+	return "heatmaps_" + resolution_name(resolution) + ".npz"
+
+def region_extent(regions): # (xmin, xmax, ymin, ymax) covering every slice of the regions
+	xs = []
+	ys = []
+	for region in regions:
+		if region.num_slices == 0:
+			continue
+		bounds = region.slice_bounds()
+		xs += [bounds["bottom_left_xpos"].min(), bounds["top_left_xpos"].min(), bounds["bottom_right_xpos"].max(), bounds["top_right_xpos"].max()]
+		ys += [bounds["bottom"].min(), bounds["top"].max()]
+	if len(xs) == 0:
+		raise ValueError("regions have no slices to draw")
+	return (min(xs), max(xs), min(ys), max(ys))
+
+def pixel_centers(extent, resolution): # x and y of the centres of the pixel columns and rows covering extent, with pixels of size resolution
+	xmin, xmax, ymin, ymax = extent
+	nx = max(1, int(math.ceil((xmax - xmin) / resolution)))
+	ny = max(1, int(math.ceil((ymax - ymin) / resolution)))
+	return xmin + resolution * (numpy.arange(nx) + 0.5), ymin + resolution * (numpy.arange(ny) + 0.5)
+
+def slice_labels(region, xs, ys): # (len(ys), len(xs)) slice index of every pixel centre, -1 outside every slice
+	# Uses the test of Region.assign_cells. The slices tile the region from left to right, so on every pixel row the left
+	# edges of the slices are sorted: one searchsorted over all rows at once (rows kept apart by an offset) finds the only
+	# slice a pixel can be in, which is then checked against its edges.
+	xs = numpy.asarray(xs, dtype=float)
+	ys = numpy.asarray(ys, dtype=float)
+	labels = numpy.full((len(ys), len(xs)), -1, dtype=int)
+	num_slices = region.num_slices
+	if num_slices == 0 or labels.size == 0:
+		return labels
+	bounds = region.slice_bounds()
+	y = ys[:, None]
+	left = bounds["bottom_left_xpos"] + (y - bounds["bottom"]) / bounds["slopeL"]	# (rows, slices) x of the slice edges on every pixel row
+	right = bounds["bottom_right_xpos"] + (y - bounds["bottom"]) / bounds["slopeR"]
+	low = min(left.min(), xs.min())
+	offset = (max(left.max(), xs.max()) - low + 1.0) * numpy.arange(len(ys))[:, None]
+	position = numpy.searchsorted(((left - low) + offset).ravel(), ((xs - low) + offset).ravel(), side='left')
+	candidate = position.reshape(labels.shape) - num_slices * numpy.arange(len(ys))[:, None] - 1	# last slice whose left edge is left of the pixel
+	candidate = numpy.clip(candidate, 0, num_slices - 1)
+	rows = numpy.arange(len(ys))[:, None]
+	x = xs[None, :]
+	inside = (left[rows, candidate] < x) & (x <= right[rows, candidate])
+	inside &= (bounds["bottom"][candidate] <= y) & (y <= bounds["top"][candidate])
+	labels[inside] = candidate[inside]
+
+	# The last slice also keeps points on its left edge
+	last = num_slices - 1
+	on_edge = (labels < 0) & (left[:, last:] == x) & (x <= right[:, last:]) & (bounds["bottom"][last] <= y) & (y <= bounds["top"][last])
+	labels[on_edge] = last
+	return labels
+
+def fill(labels, values, empty = numpy.nan): # image of per-slice values: values[label] at every pixel, empty outside the slices
+	values = numpy.append(numpy.asarray(values, dtype=float), empty)	# label -1 picks the appended empty value
+	return values[labels]
+
+def cell_levels(region, level): # level of every cell in a slice of the region, with the rows of the cells
+	rows = numpy.unique(region.member_rows)
+	cells = region.cells
+	if level == "her1_bgN":
+		return cells.her1_bgN(rows), rows
+	if level == "her7_bgN":
+		return cells.her7_bgN(rows), rows
+	return getattr(cells, level)[rows], rows
+
+def cell_image(region, level, extent, resolution, empty = numpy.nan): # mean level of the cells in every pixel, empty where there is no cell
+	xs, ys = pixel_centers(extent, resolution)
+	values, rows = cell_levels(region, level)
+	column = numpy.clip(((region.cells.x[rows] - extent[0]) / resolution).astype(int), 0, len(xs) - 1)
+	row = numpy.clip(((region.cells.y[rows] - extent[2]) / resolution).astype(int), 0, len(ys) - 1)
+	pixel = row * len(xs) + column
+	count = numpy.bincount(pixel, minlength=len(xs) * len(ys))
+	total = numpy.bincount(pixel, values, minlength=len(xs) * len(ys))
+	image = numpy.full(len(xs) * len(ys), empty, dtype=float)
+	image[count > 0] = total[count > 0] / count[count > 0]
+	return image.reshape(len(ys), len(xs))
+
+def embryo_heatmaps(analysis, resolution = 1.0, statistics = STATISTICS, levels = [], extent = None): # heatmaps of every region of an EmbryoAnalysis on one pixel grid
+	# Returns {"extent", "<region>_labels", "<region>_<statistic>" for every statistic, "<region>_<level>" for every cell level}
+	# Image row 0 is the bottom (lowest y) of the extent
+	if extent is None:
+		extent = region_extent(analysis.regions)
+	xs, ys = pixel_centers(extent, resolution)
+	heatmaps = {"extent": numpy.array([extent[0], extent[0] + len(xs) * resolution, extent[2], extent[2] + len(ys) * resolution])}	# covered by the pixels
+	for region in analysis.regions:
+		labels = slice_labels(region, xs, ys)
+		heatmaps[region.name + "_labels"] = labels
+		stats = region.slice_statistics()
+		for statistic in statistics:
+			heatmaps[region.name + "_" + statistic] = fill(labels, stats[statistic])
+		for level in levels:
+			heatmaps[region.name + "_" + level] = cell_image(region, level, extent, resolution)
+	return heatmaps
+
+def combined(heatmaps, key): # one image of every region's heatmap of key, regions do not overlap
+	image = None
+	for name in ["L", "R"]:
+		if name + "_" + key in heatmaps:
+			values = heatmaps[name + "_" + key]
+			image = values if image is None else numpy.where(numpy.isnan(values), image, values)
+	return image
+
+def save_heatmaps(directory, heatmaps, resolution):
+	numpy.savez(directory + "/" + heatmap_file(resolution), **heatmaps)
+
+def load_heatmaps(filename):
+	with numpy.load(filename) as data:
+		return dict(data)
+
+def plot_heatmaps(directory, heatmaps, resolution, keys = STATISTICS): # draw heatmap_<key>_<resolution>.png of every key
+	plt = plotting.pyplot()
+	extent = heatmaps["extent"]
+	for key in keys:
+		image = combined(heatmaps, key)
+		if image is None:
+			continue
+		plt.figure()
+		plt.imshow(numpy.ma.masked_invalid(image), origin='lower', extent=tuple(extent), interpolation='nearest', cmap='viridis')
+		plt.colorbar(label=key)
+		plt.xlabel('x')
+		plt.ylabel('y')
+		plt.savefig(directory + "/heatmap_" + key + "_" + resolution_name(resolution) + ".png", format="png", dpi=300)
+		plt.close()
+
+def write_heatmaps(directory, analysis, resolutions, render = True, statistics = STATISTICS, levels = []): # save (and draw) the heatmaps of an EmbryoAnalysis at every pixel size
+	extent = region_extent(analysis.regions)
+	for resolution in resolutions:
+		heatmaps = embryo_heatmaps(analysis, resolution, statistics, levels, extent)
+		save_heatmaps(directory, heatmaps, resolution)
+		if render:
+			plot_heatmaps(directory, heatmaps, resolution, list(statistics) + list(levels))
+
+def main():
+	args = sys.argv[1:]
+	resolution = None
+	if len(args) >= 2 and (args[0] == '-r' or args[0] == '--resolution'):
+		if not shared.isFloat(args[1]) or float(args[1]) <= 0:
+			usage()
+		resolution = args[1]
+		args = args[2:]
+	if resolution is None or len(args) == 0:
+		usage()
+	for directory in args:
+		heatmaps = load_heatmaps(directory + "/" + heatmap_file(resolution))
+		keys = sorted(set(key[2:] for key in heatmaps if key[:2] in ["L_", "R_"] and key[2:] != "labels"))
+		plot_heatmaps(directory, heatmaps, resolution, keys)
+
+def usage():
+	print("heatmap.py: Invalid command-line arguments.")
+	print("Format: python heatmap.py -r <pixel size, as given to embryo_analysis.py -hm> <embryo output directory> [<embryo output directory> ...]")
+	print("Each directory must contain the " + heatmap_file("<pixel size>") + " written by embryo_analysis.py -hm.")
+	exit(1)
+
+if __name__ == "__main__":
+	main()
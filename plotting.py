@@ -0,0 +1,117 @@
+"""
+Plot her1/her7 expression histograms, separately from the analysis
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys
+import numpy
+import shared
+from multiprocessing import Pool
+
+HISTOGRAMS = "histograms.npz"	# histogram counts saved in an embryo output directory
+NUM_BINS = 50
+
+def histogram_counts(her1, her7, num_bins = NUM_BINS): # normalized (density) histograms of her1, her7 and total her levels
+	hist = {}
+	for key, levels in [("her1", her1), ("her7", her7), ("her", her1 + her7)]:
+		density, edges = numpy.histogram(levels, num_bins, density=True)
+		hist[key + "_density"] = density
+		hist[key + "_edges"] = edges
+	return hist
+
+def save_histograms(directory, hist):
+	numpy.savez(directory + "/" + HISTOGRAMS, **hist)
+
+def load_histograms(directory):
+	with numpy.load(directory + "/" + HISTOGRAMS) as data:
+		return dict(data)
+
+def pyplot(): # import matplotlib on first use only, with a backend that needs no display
+	import matplotlib
+	matplotlib.use("Agg")
+	import matplotlib.pyplot as plt
+	return plt
+
+def bars(plt, hist, key, **style): # draw a precomputed histogram
+	edges = hist[key + "_edges"]
+	plt.bar(edges[:-1], hist[key + "_density"], width=numpy.diff(edges), align='edge', linewidth=0, **style)
+
+def plot_histograms(directory, hist = None): # draw totalherhist.png from histogram counts, loading them from the directory if not given
+	if hist is None:
+		hist = load_histograms(directory)
+	plt = pyplot()
+	plt.figure()
+
+	# Plot her1 & her7 expression distribution
+	plt.subplot(211)
+	bars(plt, hist, "her7", color='lightblue', alpha=1.0, label='her7')
+	bars(plt, hist, "her1", color='orange', alpha=0.5, label='her1')
+	plt.legend()
+	plt.tick_params(direction='in')
+	plt.ylabel('Frequency')
+
+	# Plot total her expression distribution
+	plt.subplot(212)
+	bars(plt, hist, "her", color='orange', alpha=1.0, label='Total her')
+	plt.legend()
+	plt.tick_params(direction='in')
+	plt.ylabel('Frequency')
+	plt.xlabel('mRNA expression level')
+	plt.savefig(directory + "/totalherhist.png", format = "png", dpi=300)
+	plt.close()
+
+def plot_directory(directory): # plot_histograms for a worker process, return an error message instead of raising
+	try:
+		plot_histograms(directory)
+	except Exception as e:
+		return (directory, type(e).__name__ + ": " + str(e))
+	return (directory, None)
+
+def render_batch(directories, processes = None): # draw the histograms saved in many embryo output directories in a pool of worker processes
+	errors = []
+	pool = Pool(processes)
+	try:
+		for directory, error in pool.imap_unordered(plot_directory, directories):
+			if error is not None:
+				errors.append((directory, error))
+	finally:
+		pool.close()
+		pool.join()
+	return errors
+
+def main():
+	args = sys.argv[1:]
+	processes = None
+	if len(args) >= 2 and (args[0] == '-p' or args[0] == '--processes'):
+		if not shared.isInt(args[1]) or int(args[1]) < 1:
+			usage()
+		processes = int(args[1])
+		args = args[2:]
+	if len(args) == 0:
+		usage()
+	errors = render_batch(args, processes)
+	for directory, error in errors:
+		print("plotting.py: " + directory + ": " + error)
+	if len(errors) > 0:
+		exit(1)
+
+def usage():
+	print("plotting.py: Invalid command-line arguments.")
+	print("Format: python plotting.py -p <optional:number of worker processes> <embryo output directory> [<embryo output directory> ...]")
+	print("Each directory must contain the " + HISTOGRAMS + " written by embryo_analysis.py.")
+	exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -23,62 +23,66 @@ import numpy
 import math
 import itertools
 from slices import Slice
+from cells import CellTable
+from stats import slice_statistics, slice_intervals
+import timing
 
 class Region:
-	def __init__(self, num_sec, cell_lists, name, angle, delta_angle):
+	def __init__(self, num_sec, cells, name, angle, delta_angle, index = None, slice_width = 8, recorder = timing.NULL, CB = 0.0, YB = 0.0):
+		# cells: CellTable, or lists of per-cell objects (one list per section) with background noise means CB and YB
 		self.secs = []
 		self.name = name
 		self.num_sec = num_sec
-		self.cell_list = []
-		for i in range(num_sec):
-			self.cell_list += cell_lists[i]		
-		self.slice_width = 8
+		if not isinstance(cells, CellTable):	# lists of per-cell objects, one list per section
+			cells = CellTable.from_cell_lists(cells[:num_sec], CB, YB)
+		self.cells = cells	# CellTable shared with the caller and the slices
+		if index is None:
+			index = numpy.arange(len(cells))
+		index = numpy.asarray(index, dtype=int)
+		index = index[cells.section[index] < num_sec]
+		self.index = index[numpy.argsort(cells.section[index], kind='stable')]	# rows of the region's cells, ordered by section
+		self.slice_width = slice_width
 		self.radian = angle/180 * math.pi
 		self.delta_radian = delta_angle/180 * math.pi
 		self.slope = math.tan(self.radian)
-		self.xs_ys_calc()
-		self.single_cell_boundaries()
-		self.left_corners_calc()
-		self.right_corners_calc()
-		#self.create_slices()	# Old function to create fix angle slices
-		self.create_dynamic_slice()
+		with recorder.stage("geometry") as stage:
+			self.xs_ys_calc()
+			self.single_cell_boundaries()
+			self.left_corners_calc()
+			self.right_corners_calc()
+			#self.create_slices()	# Old function to create fix angle slices
+			self.create_dynamic_slice()
+			stage.count(slices=self.num_slices)
+		with recorder.stage("slicing") as stage:	# all slices at once; Slice.identify_cells, the per-slice test, is not called here
+			self.assign_cells()
+			stage.count(cells=len(self.index))
+		self.stats = {}	# per-slice statistics, computed on first use by slice_statistics()
+		self.intervals = {}	# confidence intervals of the last slice_intervals() call, reported next to the statistics by the writers
 		
+	@property
+	def cell_list(self):	# per-cell views, for code that iterates over cell objects
+		return self.cells.cells(self.index)
 
 	def xs_ys_calc(self):	# to read x and y position for every cell
-		self.xs = []
-		self.ys = []
-		for cell in self.cell_list:
-			self.xs.append(cell.xpos)
-			self.ys.append(cell.ypos)
+		self.xs = self.cells.x[self.index]
+		self.ys = self.cells.y[self.index]
 
 	def single_cell_boundaries(self):	# find bottom, top, leftmost and rightmost cell position 
-		self.bottom = self.cell_list[self.ys.index(min(self.ys))] # bottom cell
-		self.top = self.cell_list[self.ys.index(max(self.ys))] # top cell
-		self.left = self.cell_list[self.xs.index(min(self.xs))] # leftmost cell
-		self.right = self.cell_list[self.xs.index(max(self.xs))] # rightmost cell
+		self.bottom = self.cells.cell(self.index[numpy.argmin(self.ys)]) # bottom cell
+		self.top = self.cells.cell(self.index[numpy.argmax(self.ys)]) # top cell
+		self.left = self.cells.cell(self.index[numpy.argmin(self.xs)]) # leftmost cell
+		self.right = self.cells.cell(self.index[numpy.argmax(self.xs)]) # rightmost cell
 
 	def left_corners_calc(self):	# Define left border with fix angle
-		bottom_candidates = []
-		top_candidates = []
-		for cell in self.cell_list:
-			bottom_candidates.append(cell.xpos + (self.bottom.ypos - cell.ypos)/self.slope)
-			top_candidates.append(cell.xpos + (self.top.ypos - cell.ypos)/self.slope)
-		self.bottom_left_xpos = min(bottom_candidates)
-		self.top_left_xpos = min(top_candidates)
+		self.bottom_left_xpos = float(numpy.min(self.xs + (self.bottom.ypos - self.ys)/self.slope))
+		self.top_left_xpos = float(numpy.min(self.xs + (self.top.ypos - self.ys)/self.slope))
 
 						
 	def right_corners_calc(self):	# Calculate right border for angle change algorithm
-		bottom_candidates = []
-		top_candidates = []
-		radian = self.radian
-		delta_radian = self.delta_radian
 		baseline_left_xpos = max(self.bottom_left_xpos, self.top_left_xpos)
-		for cell in self.cell_list:
-			approx_slope = math.tan(radian + (cell.xpos - baseline_left_xpos) * delta_radian)
-			bottom_candidates.append(cell.xpos + (self.bottom.ypos - cell.ypos)/approx_slope)
-			top_candidates.append(cell.xpos + (self.top.ypos - cell.ypos)/approx_slope)
-		self.bottom_right_xpos = max(bottom_candidates)
-		self.top_right_xpos = max(top_candidates)	
+		approx_slopes = numpy.tan(self.radian + (self.xs - baseline_left_xpos) * self.delta_radian)	# slope at every cell for the changing angle
+		self.bottom_right_xpos = float(numpy.max(self.xs + (self.bottom.ypos - self.ys)/approx_slopes))
+		self.top_right_xpos = float(numpy.max(self.xs + (self.top.ypos - self.ys)/approx_slopes))	
 		
 	def create_slices(self):		# Create slices with fix angle - not in used for angle change version
 		self.slices = []
@@ -149,4 +153,75 @@ class Region:
 				top_right_xpos += self.slice_width
 				bottom_left_xpos = bottom_right_xpos	# replace next bottom left xpos with current bottom right xpos
 				bottom_right_xpos += (self.slice_width + abs(self.height/math.tan(cur_radian+delta_radian) - self.height/math.tan(cur_radian)))
-						
\ No newline at end of file
+
+	def slice_bounds(self):	# boundaries of every slice as arrays, one entry per slice
+		bounds = {}
+		for key in ["bottom", "top", "bottom_left_xpos", "bottom_right_xpos", "top_left_xpos", "top_right_xpos", "slopeL", "slopeR"]:
+			bounds[key] = numpy.array([getattr(s, key) for s in self.slices], dtype=float)
+		bounds["last_slice"] = numpy.array([s.last_slice for s in self.slices], dtype=bool)
+		return bounds
+
+	def assign_cells(self, max_block = 2**22):	# Assign every cell to its slice in one vectorized pass over all slices
+		xs = self.xs
+		ys = self.ys
+		num_cells = len(xs)
+		
+		# Slice boundaries as column vectors, one row per slice
+		bounds = self.slice_bounds()
+		bottom = bounds["bottom"][:, None]
+		top = bounds["top"][:, None]
+		bottom_left_xpos = bounds["bottom_left_xpos"][:, None]
+		bottom_right_xpos = bounds["bottom_right_xpos"][:, None]
+		slopeL = bounds["slopeL"][:, None]
+		slopeR = bounds["slopeR"][:, None]
+		last_slice = bounds["last_slice"][:, None]
+		
+		# Test cells in blocks so that the slices x cells boolean matrix stays bounded in memory
+		block = max(1, int(max_block / max(1, self.num_slices)))
+		member_slices = []
+		member_cells = []
+		for start in range(0, num_cells, block):
+			x = xs[start:start+block]
+			y = ys[start:start+block]
+			left_boundary = bottom_left_xpos + (y - bottom)/slopeL
+			right_boundary = bottom_right_xpos + (y - bottom)/slopeR
+			inside = numpy.where(last_slice, left_boundary <= x, left_boundary < x)	# the last slice also keeps cells on its left edge
+			inside &= (x <= right_boundary) & (bottom <= y) & (y <= top)
+			slice_ids, cell_ids = numpy.nonzero(inside)
+			member_slices.append(slice_ids)
+			member_cells.append(cell_ids + start)
+		member_slices = numpy.concatenate(member_slices) if member_slices else numpy.zeros(0, dtype=int)
+		member_cells = numpy.concatenate(member_cells) if member_cells else numpy.zeros(0, dtype=int)
+		
+		# Group (slice, cell) pairs by slice, keeping the original cell order within each slice
+		order = numpy.argsort(member_slices, kind='stable')
+		self.member_slices = member_slices[order]
+		self.member_cells = member_cells[order]	# positions in self.index
+		self.member_rows = self.index[self.member_cells]	# rows in self.cells
+		self.slice_offsets = numpy.zeros(self.num_slices + 1, dtype=int)
+		numpy.cumsum(numpy.bincount(self.member_slices, minlength=self.num_slices), out=self.slice_offsets[1:])
+		
+		# Per-cell slice index (-1 if outside every slice). A cell lying exactly on the left edge of the last slice also
+		# belongs to the slice before it; it keeps the lower index here and is listed in both slices' member_cells.
+		self.slice_index = numpy.full(num_cells, -1, dtype=int)
+		cells, first = numpy.unique(self.member_cells, return_index=True)
+		self.slice_index[cells] = self.member_slices[first]
+		
+		for i in range(self.num_slices):
+			self.slices[i].set_cells(self.cells, self.member_rows[self.slice_offsets[i]:self.slice_offsets[i+1]])
+
+	def slice_statistics(self, higher_moments = False, covariance = False):	# per-slice cell counts, means, variances and standard deviations, NaN for slices with fewer than 3 cells
+		key = (higher_moments, covariance)
+		if key not in self.stats:
+			cells = self.cells
+			stats = slice_statistics(self.member_slices, self.num_slices, cells.her1[self.member_rows], cells.her7[self.member_rows],
+				cells.CB, cells.YB, 3, higher_moments, covariance)
+			stats["slice"] = numpy.arange(1, self.num_slices + 1)	# slice numbers as written to the Excel sheets
+			self.stats[key] = stats
+		return self.stats[key]
+
+	def slice_intervals(self, method = "bootstrap", replicates = 1000, confidence = 0.95, seed = None):	# confidence intervals of the slice means and variances, resampling all slices at once
+		cells = self.cells
+		self.intervals = slice_intervals(self.member_slices, self.num_slices, cells.her1[self.member_rows], cells.her7[self.member_rows],
+			cells.CB, cells.YB, method, replicates, confidence, seed)
+		return self.intervals
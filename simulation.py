@@ -0,0 +1,847 @@
+"""
+Stochastic simulation of the her1/her7 delayed gene expression model (the genepaired/geneunpaired scenario scripts)
+The model has 16 reactions and 4 delayed channels (her1/her7 mRNA and protein synthesis), simulated with the delayed
+modified next reaction method. The reaction network is kept as data (rates, reactants, stoichiometry and the mapping
+of reactions to delayed channels) so the paired/unpaired genes and scenarios 1 to 3 are only different configurations.
+
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys, os, math, heapq, time, pickle, shutil
+import numpy
+from numpy.lib.format import open_memmap
+import xlwt
+import shared
+from cells import CellTable
+from stats import ranks, correlation, correlation_p, Moments, CoMoments, Histogram2D, Reservoir
+from multiprocessing import Pool
+
+inf = float("inf")
+
+SPECIES = ["c1", "c1h1h1", "c1h6h7", "c2", "c2h1h1", "c2h6h7", "mh1", "mh7", "ph1", "ph7", "ph6"]	# c1/c2: free her1/her7 genes, cXhYhZ: genes bound by a dimer
+INITIAL = {"c1": 1, "c2": 1, "ph6": 100}	# species not listed start at 0
+
+RATES = {
+	"msh1": 5, "msh7": 5, "mdh1": 0.2, "mdh7": 0.2,	# mRNA synthesis and degradation rates
+	"psh1": 5, "psh7": 5, "pdh1": 0.3, "pdh7": 0.3,	# protein synthesis and degradation rates
+	"ac1h1h1": 0.01, "dc1h1h1": 400,	# DNA association and dissociation rates
+	"ac2h1h1": 0.01, "dc2h1h1": 400,
+	"ac1h6h7": 0.01, "dc1h6h7": 400,
+	"ac2h6h7": 0.01, "dc2h6h7": 400,
+	"nmh1": 9, "nmh7": 9,	# mRNA and protein synthesis time delays
+	"nph1": 1, "nph7": 1,
+}
+
+# Differences of the scenarios from RATES, and the mRNA molecules made by one delayed transcription (low, high: uniform integer)
+SCENARIOS = {
+	1: {"rates": {}, "mh1": (1, 1), "mh7": (1, 1)},
+	2: {"rates": {}, "mh1": (1, 2), "mh7": (1, 2)},
+	3: {"rates": {"mdh1": 0.4, "mdh7": 0.6}, "mh1": (2, 2), "mh7": (3, 3)},
+}
+
+def model_reactions(paired): # reactions as (name, rate, reactants, changes, delayed channels); reactants are (species, order) pairs
+	# Paired genes: her1 transcription starts the delayed synthesis of both mRNAs, and her7 transcription has no effect
+	return [
+		("her1 transcription", "msh1", [("c1", 1)], {}, ["mh1", "mh7"] if paired else ["mh1"]),
+		("her7 transcription", "msh7", [("c2", 1)], {}, [] if paired else ["mh7"]),
+		("her1 translation", "psh1", [("mh1", 1)], {}, ["ph1"]),
+		("her7 translation", "psh7", [("mh7", 1)], {}, ["ph7"]),
+		("her1 mRNA degradation", "mdh1", [("mh1", 1)], {"mh1": -1}, []),
+		("her7 mRNA degradation", "mdh7", [("mh7", 1)], {"mh7": -1}, []),
+		("her1 protein degradation", "pdh1", [("ph1", 1)], {"ph1": -1}, []),
+		("her7 protein degradation", "pdh7", [("ph7", 1)], {"ph7": -1}, []),
+		("her1 gene binds her1 dimer", "ac1h1h1", [("c1", 1), ("ph1", 2)], {"c1": -1, "ph1": -2, "c1h1h1": 1}, []),
+		("her1 gene binds her6/her7", "ac1h6h7", [("c1", 1), ("ph6", 1), ("ph7", 1)], {"c1": -1, "ph7": -1, "c1h6h7": 1}, []),	# her6 is kept constant
+		("her7 gene binds her1 dimer", "ac2h1h1", [("c2", 1), ("ph1", 2)], {"c2": -1, "ph1": -2, "c2h1h1": 1}, []),
+		("her7 gene binds her6/her7", "ac2h6h7", [("c2", 1), ("ph6", 1), ("ph7", 1)], {"c2": -1, "ph7": -1, "c2h6h7": 1}, []),
+		("her1 gene releases her1 dimer", "dc1h1h1", [("c1h1h1", 1)], {"c1": 1, "ph1": 2, "c1h1h1": -1}, []),
+		("her1 gene releases her6/her7", "dc1h6h7", [("c1h6h7", 1)], {"c1": 1, "ph7": 1, "c1h6h7": -1}, []),
+		("her7 gene releases her1 dimer", "dc2h1h1", [("c2h1h1", 1)], {"c2": 1, "ph1": 2, "c2h1h1": -1}, []),
+		("her7 gene releases her6/her7", "dc2h6h7", [("c2h6h7", 1)], {"c2": 1, "ph7": 1, "c2h6h7": -1}, []),
+	]
+
+def model_channels(scenario): # delayed channels as (name, delay, species, (low, high) molecules made)
+	return [
+		("mh1", "nmh1", "mh1", scenario["mh1"]),
+		("mh7", "nmh7", "mh7", scenario["mh7"]),
+		("ph1", "nph1", "ph1", (1, 1)),
+		("ph7", "nph7", "ph7", (1, 1)),
+	]
+
+class Model: # reaction network as arrays: propensity rates and reactants, stoichiometry matrix and delay mapping
+	def __init__(self, species, initial, reactions, channels, rates):
+		self.species = list(species)
+		position = dict((name, i) for i, name in enumerate(self.species))
+		self.initial = numpy.array([initial.get(name, 0) for name in self.species], dtype=numpy.int64)
+		self.reaction_names = [reaction[0] for reaction in reactions]
+		self.channel_names = [channel[0] for channel in channels]
+		channel_position = dict((name, i) for i, name in enumerate(self.channel_names))
+		num_reactions = len(reactions)
+		num_channels = len(channels)
+
+		# Propensity of reaction j: rates[j] times the product of comb(x[s], order) over its reactants
+		self.rates = numpy.array([rates[reaction[1]] for reaction in reactions], dtype=float)
+		self.reactants = [tuple((position[s], order) for s, order in reaction[2]) for reaction in reactions]
+		self.stoichiometry = numpy.zeros((num_reactions, len(self.species)), dtype=numpy.int64)	# immediate changes of every reaction
+		for j, reaction in enumerate(reactions):
+			for s, change in reaction[3].items():
+				self.stoichiometry[j, position[s]] = change
+		self.changes = [tuple((s, int(n)) for s, n in enumerate(row) if n != 0) for row in self.stoichiometry]	# the same, as (species, change) pairs
+		self.delayed = [tuple(channel_position[c] for c in reaction[4]) for reaction in reactions]	# delayed channels started by every reaction
+		self.delays = numpy.array([rates[channel[1]] for channel in channels], dtype=float)
+		self.channel_species = numpy.array([position[channel[2]] for channel in channels], dtype=int)
+		self.increments = numpy.array([channel[3] for channel in channels], dtype=numpy.int64).reshape(num_channels, 2)	# (low, high) molecules made by a completion
+
+		# Reactions whose propensity changes when a reaction fires or a delayed channel completes
+		depends = numpy.zeros((num_reactions, len(self.species)), dtype=bool)
+		for j in range(num_reactions):
+			for s, order in self.reactants[j]:
+				depends[j, s] = True
+		self.reaction_dependents = [tuple(numpy.flatnonzero(depends[:, self.stoichiometry[j] != 0].any(axis=1) | (numpy.arange(num_reactions) == j))) for j in range(num_reactions)]
+		self.channel_dependents = [tuple(numpy.flatnonzero(depends[:, self.channel_species[c]])) for c in range(num_channels)]
+
+		# Propensity factors as columns of [x, x(x-1)/2, 1], for computing every propensity at once (the last column pads)
+		width = max(len(r) for r in self.reactants)
+		num_species = len(self.species)
+		self.factor_columns = numpy.full((width, num_reactions), 2 * num_species, dtype=int)
+		for j, r in enumerate(self.reactants):
+			for k, (s, order) in enumerate(r):
+				if order > 2:
+					raise ValueError("reactions of order " + str(order) + " in one species are not supported")
+				self.factor_columns[k, j] = s if order == 1 else num_species + s
+
+	def index(self, name): # position of a species in the state vector
+		return self.species.index(name)
+
+	def propensity(self, j, x): # propensity of reaction j in state x
+		a = self.rates[j]
+		for s, order in self.reactants[j]:
+			a *= math.comb(x[s], order)
+		return float(a)
+
+	def propensities(self, x): # propensities of every reaction in state x (one state, or one state per row)
+		x = numpy.asarray(x, dtype=float)
+		factors = numpy.concatenate([x, x * numpy.maximum(x - 1, 0) / 2, numpy.ones(x.shape[:-1] + (1,))], axis=-1)
+		a = self.rates * factors[..., self.factor_columns[0]]
+		for columns in self.factor_columns[1:]:
+			a *= factors[..., columns]
+		return a
+
+def scenario_model(scenario = 1, paired = True): # Model of the genepaired_scenario<N>.m (paired) or geneunpaired_scenario<N>.m script
+	if scenario not in SCENARIOS:
+		raise ValueError("unknown scenario " + str(scenario))
+	config = SCENARIOS[scenario]
+	rates = dict(RATES)
+	rates.update(config["rates"])
+	return Model(SPECIES, INITIAL, model_reactions(paired), model_channels(config), rates)
+
+class EventRecorder: # time and selected species counts after every event, in arrays that grow by doubling
+	def __init__(self, model, species = ("mh1", "mh7"), capacity = 65536):
+		self.columns = [model.index(name) for name in species]
+		self.species = list(species)
+		self.time = numpy.empty(capacity)
+		self.counts = numpy.empty((capacity, len(self.columns)), dtype=numpy.int64)
+		self.size = 0
+
+	def record(self, T, x):
+		if self.size == len(self.time):
+			self.time = numpy.concatenate([self.time, numpy.empty(len(self.time))])
+			self.counts = numpy.concatenate([self.counts, numpy.empty(self.counts.shape, dtype=numpy.int64)])
+		self.time[self.size] = T
+		row = self.counts[self.size]
+		for i, s in enumerate(self.columns):
+			row[i] = x[s]
+		self.size += 1
+
+	def values(self, name): # recorded counts of one species
+		return self.counts[:self.size, self.species.index(name)]
+
+	def finish(self, T):
+		pass
+
+	@property
+	def times(self):
+		return self.time[:self.size]
+
+class GridRecorder: # selected species counts at fixed times, written into a preallocated (or memory-mapped) array
+	# Memory use depends on the grid only, not on the number of events. Grid points after the end of the run stay NaN.
+	def __init__(self, model, grid, species = ("mh1", "mh7"), out = None):
+		# out: array of shape (grid points, species) to write into, e.g. one run of a memory-mapped ensemble file
+		self.columns = [model.index(name) for name in species]
+		self.species = list(species)
+		self.grid = numpy.asarray(grid, dtype=float)
+		if out is None:
+			out = numpy.empty((len(self.grid), len(self.columns)))
+		out[...] = numpy.nan
+		self.samples = out
+		self.next = 0	# first grid point not filled yet
+		self.next_time = self.grid[0] if len(self.grid) > 0 else inf
+		self.last = [0] * len(self.columns)	# counts since the last event
+
+	def fill(self, T, inclusive): # fill the grid points before T (or up to T) with the counts since the last event
+		stop = int(numpy.searchsorted(self.grid, T, 'right' if inclusive else 'left'))
+		self.samples[self.next:stop] = self.last
+		self.next = stop
+		self.next_time = self.grid[stop] if stop < len(self.grid) else inf
+
+	def record(self, T, x): # called after every event with the new counts
+		if T > self.next_time:
+			self.fill(T, False)
+		last = self.last
+		for i, s in enumerate(self.columns):
+			last[i] = x[s]
+
+	def finish(self, T): # the run stopped at time T
+		self.fill(T, True)
+
+	def values(self, name): # sampled counts of one species
+		return self.samples[:, self.species.index(name)]
+
+class StreamRecorder: # streaming summaries of two species after every event, without keeping the trajectory
+	# Counts are buffered in blocks and added to mergeable accumulators (see stats.py): means and variances, the co-moment for
+	# the Pearson correlation, a 2D histogram and a reservoir sample for a Spearman estimate
+	def __init__(self, model, species = ("mh1", "mh7"), edges = numpy.arange(201) - 0.5, reservoir = 10000, seed = None, block = 4096):
+		self.columns = [model.index(name) for name in species]
+		self.species = list(species)
+		self.moments = Moments(len(species))
+		self.comoments = CoMoments()
+		self.histogram = Histogram2D(edges, edges)	# one bin per count by default, larger counts go to the last bin
+		self.reservoir = Reservoir(reservoir, seed)
+		self.buffer = numpy.empty((block, len(species)))
+		self.size = 0
+
+	def record(self, T, x):
+		row = self.buffer[self.size]
+		for i, s in enumerate(self.columns):
+			row[i] = x[s]
+		self.size += 1
+		if self.size == len(self.buffer):
+			self.flush()
+
+	def flush(self): # add the buffered counts to the accumulators
+		if self.size == 0:
+			return
+		values = self.buffer[:self.size]
+		self.moments.add(values)
+		self.comoments.add(values[:, 0], values[:, 1])
+		self.histogram.add(values[:, 0], values[:, 1])
+		self.reservoir.add(values[:, 0], values[:, 1])
+		self.size = 0
+
+	def finish(self, T):
+		self.flush()
+
+	def merge(self, other): # summaries of the events of both recorders
+		self.flush()
+		other.flush()
+		self.moments.merge(other.moments)
+		self.comoments.merge(other.comoments)
+		self.histogram.merge(other.histogram)
+		self.reservoir.merge(other.reservoir)
+		return self
+
+	def correlations(self): # as correlations(), from the accumulators
+		pearson = float(self.comoments.correlation)
+		spearman, spearman_p = self.reservoir.spearman()
+		return pearson, correlation_p(pearson, int(self.comoments.count)), spearman, spearman_p
+
+class Simulation: # state of one run of the delayed modified next reaction method
+	def __init__(self, model, rng):
+		self.model = model
+		self.rng = rng	# numpy.random.Generator
+		num_reactions = len(model.rates)
+		self.T = 0.0	# simulation time
+		self.steps = 0	# events simulated
+		self.x = [int(n) for n in model.initial]	# species counts, as Python ints for the scalar loop
+		self.a = [model.propensity(j, self.x) for j in range(num_reactions)]
+		self.Tk = [0.0] * num_reactions	# internal time of every reaction's Poisson process, as of time updated[j]
+		self.Pk = [float(p) for p in rng.standard_exponential(num_reactions)]	# internal time of its next firing
+		self.updated = [0.0] * num_reactions
+		self.tnext = [self.Pk[j] / self.a[j] if self.a[j] > 0 else inf for j in range(num_reactions)]	# absolute time of the next firing
+		self.pending = []	# heap of (absolute completion time, channel) of the pending delayed reactions, or (first time, channel, count, span) for
+					# count reactions started by a tau-leap, which complete at uniformly spread times within span
+		self.leaps = 0	# tau-leaps among the steps
+		self.clocks = True	# whether the Poisson processes are valid, tau-leaping leaves them behind
+
+	def reset_clocks(self): # restart the Poisson processes at the current time (valid as they are memoryless)
+		T = self.T
+		for j in range(len(self.a)):
+			self.a[j] = self.model.propensity(j, self.x)
+			self.Tk[j] = 0.0
+			self.Pk[j] = float(self.rng.standard_exponential())
+			self.updated[j] = T
+			self.tnext[j] = T + self.Pk[j] / self.a[j] if self.a[j] > 0 else inf
+		self.clocks = True
+
+	def expand_pending(self): # give every delayed reaction started by a tau-leap its own completion time
+		single = []
+		for item in self.pending:
+			if len(item) == 2:
+				single.append(item)
+			else:
+				t0, c, n, span = item
+				for t in (t0 + self.rng.uniform(0, span, n)).tolist():
+					single.append((t, c))
+		heapq.heapify(single)
+		self.pending[:] = single
+
+	def run(self, tend = 240, maxi = 10000000, recorder = None, pause = None): # simulate until time tend or maxi-1 events in total, as the scenario scripts
+		# pause: stop once this many events are simulated, without finishing the recorder; run() again continues exactly as if
+		# it had not stopped
+		model = self.model
+		rng = self.rng
+		if not self.clocks:	# continue after tau-leaps
+			self.reset_clocks()
+			self.expand_pending()
+		x, a, Tk, Pk, updated, tnext = self.x, self.a, self.Tk, self.Pk, self.updated, self.tnext
+		pending = self.pending
+		heappush, heappop = heapq.heappush, heapq.heappop
+		rates, reactants, delayed = model.rates.tolist(), model.reactants, model.delayed
+		changes = model.changes
+		delays, channel_species, increments = model.delays.tolist(), model.channel_species.tolist(), model.increments.tolist()
+		reaction_dependents, channel_dependents = model.reaction_dependents, model.channel_dependents
+		comb = math.comb
+		T = self.T
+		steps = self.steps
+		if recorder is not None and steps == 0:
+			recorder.record(T, x)
+		stop = maxi - 1 if pause is None else min(maxi - 1, pause)
+		while T < tend and steps < stop:
+			t_reaction = min(tnext)
+			if pending and pending[0][0] < t_reaction:	# a delayed reaction completes (ties go to the reactions, as min() in the scripts)
+				T, c = heappop(pending)	# ties between channels go to the first channel, as well
+				low, high = increments[c]
+				x[channel_species[c]] += low if low == high else int(rng.integers(low, high + 1))
+				dependents = channel_dependents[c]
+			elif t_reaction < inf:
+				j = tnext.index(t_reaction)
+				T = t_reaction
+				Tk[j] = Pk[j]	# the Poisson process of j reached its next firing
+				updated[j] = T
+				Pk[j] += rng.standard_exponential()
+				for s, n in changes[j]:
+					x[s] += n
+				for c in delayed[j]:	# start delayed reactions
+					heappush(pending, (T + delays[c], c))
+				dependents = reaction_dependents[j]
+			else:	# nothing can happen any more
+				T = inf
+				break
+			for i in dependents:	# bring the Poisson processes of the changed propensities up to time T
+				Tk[i] += a[i] * (T - updated[i])
+				updated[i] = T
+				ai = rates[i]
+				for s, order in reactants[i]:
+					ai *= comb(x[s], order)
+				a[i] = ai
+				tnext[i] = T + (Pk[i] - Tk[i]) / ai if ai > 0 else inf
+			steps += 1
+			if recorder is not None:
+				recorder.record(T, x)
+		if recorder is not None and (T >= tend or steps >= maxi - 1):
+			recorder.finish(T)
+		self.T = T
+		self.steps = steps
+		return self
+
+	def leap(self, tend = 240, maxi = 10000000, recorder = None, epsilon = 0.03, critical = 10, exact_threshold = 10, exact_steps = 100, pause = None):
+		# Delayed tau-leaping with the step size selection of Cao, Gillespie and Petzold (J Chem Phys 124, 044109, 2006):
+		# - the step keeps the expected relative change of every propensity below about epsilon
+		# - reactions that can exhaust a reactant in fewer than `critical` firings are critical and fire one at a time
+		# - when a step would hold fewer than exact_threshold events, exact_steps exact events are simulated instead
+		# Delayed reactions started in a leap complete at uniformly spread times within it plus their delay; they are kept as
+		# one batch, which later steps split binomially. Steps are at most the shortest delay, so reactions never complete in
+		# the step that started them. Every leap counts as one step towards maxi.
+		# pause: as in run(), checked between steps, so the exact events that replace a leap can go past it
+		model = self.model
+		rng = self.rng
+		nu = model.stoichiometry
+		num_reactions, num_species = nu.shape
+		consumed = numpy.maximum(-nu, 0)	# molecules used up by every reaction
+		uses = consumed > 0
+		reactant = numpy.zeros(num_species, dtype=bool)	# species in some propensity
+		hor = numpy.zeros(num_species, dtype=int)	# highest order of a reaction of every species, and its order in that reaction
+		own = numpy.zeros(num_species, dtype=int)
+		for j in range(num_reactions):
+			order = sum(o for s, o in model.reactants[j])
+			for s, o in model.reactants[j]:
+				reactant[s] = True
+				if (order, o) > (hor[s], own[s]):
+					hor[s], own[s] = order, o
+		delays, channel_species, increments = model.delays.tolist(), model.channel_species.tolist(), model.increments.tolist()
+		max_tau = min(delays) if delays else inf
+		pending = self.pending
+		stop = maxi - 1 if pause is None else min(maxi - 1, pause)
+		while self.T < tend and self.steps < stop:
+			T = self.T
+			x = numpy.array(self.x, dtype=numpy.int64)
+			a = model.propensities(x)
+			a0 = a.sum()
+
+			# Critical reactions, and the leap size allowed by the non-critical ones
+			firings = numpy.where(uses, x // numpy.maximum(consumed, 1), numpy.iinfo(numpy.int64).max).min(axis=1)	# firings until a reactant runs out
+			positive = a > 0
+			crit = positive & (firings < critical)
+			noncrit = positive & ~crit
+			mu = a[noncrit] @ nu[noncrit]
+			sigma2 = a[noncrit] @ (nu[noncrit] ** 2)
+			g = hor.astype(float)	# g of Cao et al: hor, with a correction for reactions between molecules of one species
+			g = numpy.where((own == 2) & (x > 1), hor / 2.0 * (2 + 1.0 / numpy.maximum(x - 1, 1)), g)
+			bound = numpy.maximum(epsilon * x / numpy.maximum(g, 1), 1)
+			with numpy.errstate(divide='ignore'):
+				tau1 = min(numpy.min(numpy.where(reactant & (mu != 0), bound / numpy.abs(mu), inf)),
+					numpy.min(numpy.where(reactant & (sigma2 != 0), bound * bound / sigma2, inf)), max_tau)
+			a0c = a[crit].sum()
+			if a0 == 0 or min(tau1, 1 / a0c if a0c > 0 else inf) < exact_threshold / a0:	# too few events per leap, step exactly
+				self.run(tend, min(maxi, self.steps + exact_steps + 1), recorder)
+				continue
+			if self.steps == 0 and recorder is not None:
+				recorder.record(T, self.x)
+
+			tau2 = rng.standard_exponential() / a0c if a0c > 0 else inf	# time to the next critical reaction
+			while True:
+				tau = min(tau1, tau2, tend - T)
+				K = numpy.zeros(num_reactions, dtype=numpy.int64)
+				K[noncrit] = rng.poisson(a[noncrit] * tau)
+				if tau == tau2:	# one critical reaction fires at the end of the leap
+					j = rng.choice(numpy.flatnonzero(crit), p=a[crit] / a0c)
+					K[j] += 1
+				change = K @ nu
+				end = T + tau
+				completed = []	# items taken from the queue
+				remaining = []	# batches that are only partly done by the end of the step
+				done = numpy.zeros(len(delays), dtype=numpy.int64)
+				while pending and pending[0][0] <= end:
+					item = heapq.heappop(pending)
+					completed.append(item)
+					if len(item) == 2:
+						done[item[1]] += 1
+					else:
+						t0, c, n, span = item
+						k = n if t0 + span <= end else int(rng.binomial(n, (end - t0) / span))
+						done[c] += k
+						if k < n:
+							remaining.append((end, c, n - k, t0 + span - end))
+				for c in numpy.flatnonzero(done):
+					low, high = increments[c]
+					change[channel_species[c]] += done[c] * low if low == high else int(rng.integers(low, high + 1, done[c]).sum())
+				if (x + change >= 0).all():
+					break
+				for item in completed:	# rejected: put the completions back and halve the step
+					heapq.heappush(pending, item)
+				tau1 = tau / 2
+			for item in remaining:
+				heapq.heappush(pending, item)
+			for j in numpy.flatnonzero(K):	# start delayed reactions, as one batch per reaction and channel
+				for c in model.delayed[j]:
+					if crit[j]:	# fired at the end of the step
+						heapq.heappush(pending, (end + delays[c], c))
+					else:
+						heapq.heappush(pending, (T + delays[c], c, int(K[j]), tau))
+			self.x[:] = (x + change).tolist()
+			self.T = T + tau
+			self.steps += 1
+			self.leaps += 1
+			self.clocks = False
+			if recorder is not None:
+				recorder.record(self.T, self.x)
+		if recorder is not None and (self.T >= tend or self.steps >= maxi - 1):
+			recorder.finish(self.T)
+		return self
+
+	def state(self): # everything the rest of the run depends on besides the model, e.g. for save_checkpoint: counts, propensities,
+		# Poisson processes (Tk, Pk), pending delayed reactions and the state of the random generator
+		state = {key: value for key, value in self.__dict__.items() if key not in ("model", "rng")}
+		state["rng"] = self.rng.bit_generator.state
+		return state
+
+	def restore(self, state): # continue from a state(), the generator must be of the same kind
+		for key, value in state.items():
+			if key != "rng":
+				setattr(self, key, value)
+		self.rng.bit_generator.state = state["rng"]
+		return self
+
+	def counts(self): # current species counts by name
+		return dict(zip(self.model.species, self.x))
+
+def correlations(mh1, mh7): # Pearson, PearSig, Spearman, SpearSig of her1 and her7 mRNA levels, as reported by the scenario scripts
+	pearson, pearson_p = correlation(mh1, mh7)
+	spearman, spearman_p = correlation(ranks(mh1), ranks(mh7))
+	return pearson, pearson_p, spearman, spearman_p
+
+def save_checkpoint(filename, state): # pickle state to filename, through a temporary file so an interrupted write keeps the previous checkpoint
+	temp_file = filename + "." + str(os.getpid()) + ".tmp"
+	with open(temp_file, "wb") as f:
+		pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(temp_file, filename)
+
+def load_checkpoint(filename): # state saved by save_checkpoint, or None if there is no checkpoint
+	if not os.path.isfile(filename):
+		return None
+	with open(filename, "rb") as f:
+		return pickle.load(f)
+
+def simulate(model, seed = None, tend = 240, maxi = 10000000, recorder = None): # one run from the initial state
+	simulation = Simulation(model, numpy.random.default_rng(seed))
+	return simulation.run(tend, maxi, recorder)
+
+def population_table(counts, model, template = None): # CellTable of simulated cells, with her1/her7 levels from their mh1/mh7 counts
+	# template: CellTable whose positions, sections and sides the cells take (one simulated cell per row), e.g. a segmented embryo;
+	# without one, the cells sit on a square unit grid in a single section
+	her1 = numpy.array(counts[:, model.index("mh1")], dtype=float)	# copies, the counts go on changing
+	her7 = numpy.array(counts[:, model.index("mh7")], dtype=float)
+	if template is not None:
+		return CellTable(template.x, template.y, template.z, her1, her7, template.section, template.side, 0.0, 0.0, template.num_sec)
+	width = int(math.ceil(math.sqrt(len(counts))))
+	index = numpy.arange(len(counts))
+	return CellTable(index % width, index // width, numpy.zeros(len(counts)), her1, her7, numpy.zeros(len(counts), dtype=int), None, 0.0, 0.0, 1)
+
+def simulate_population(model, num_cells, times, seed = None, template = None, capacity = 64): # snapshots of num_cells independent cells
+	# Exact delayed next reaction method for all cells at once: states, propensities and Poisson processes are arrays with a
+	# row per cell, and every iteration moves each cell that still has an event before the next snapshot time by one event.
+	# Pending delayed reactions are ring buffers per cell and channel (a channel has one delay, so they complete in order).
+	# Returns one CellTable (see population_table) per snapshot time, in increasing time order.
+	if template is not None:
+		num_cells = len(template)
+	rng = numpy.random.default_rng(seed)
+	nu = model.stoichiometry
+	num_reactions = len(model.rates)
+	num_channels = len(model.delays)
+	starts = numpy.zeros((num_reactions, num_channels), dtype=bool)	# delayed channels started by every reaction
+	for j, channels in enumerate(model.delayed):
+		starts[j, list(channels)] = True
+	low, high = model.increments[:, 0], model.increments[:, 1]
+
+	X = numpy.tile(model.initial.astype(float), (num_cells, 1))	# counts, as floats for the propensities
+	T = numpy.zeros(num_cells)
+	a = model.propensities(X)
+	Tk = numpy.zeros((num_cells, num_reactions))
+	Pk = rng.standard_exponential((num_cells, num_reactions))
+	queue = numpy.empty((num_cells, num_channels, capacity))	# completion times
+	head = numpy.zeros((num_cells, num_channels), dtype=numpy.int64)	# completions and starts so far, the queue holds head to tail-1
+	tail = numpy.zeros((num_cells, num_channels), dtype=numpy.int64)
+	heads = numpy.full((num_cells, num_channels), inf)	# earliest completion time in every queue
+	rows = numpy.arange(num_cells)
+	snapshots = []
+	for t_snap in sorted(times):
+		while True:	# every cell with an event before t_snap moves by one event
+			with numpy.errstate(divide='ignore'):
+				wait = (Pk - Tk) / a	# inf for reactions that cannot fire
+			j = numpy.argmin(wait, axis=1)
+			t_reaction = T + wait[rows, j]
+			c = numpy.argmin(heads, axis=1)
+			t_delay = heads[rows, c]
+			delayed = t_delay < t_reaction	# ties go to the reactions, as in Simulation.run
+			t_event = numpy.where(delayed, t_delay, t_reaction)
+			moving = t_event <= t_snap
+			if not moving.any():
+				break
+			Tk += a * numpy.where(moving, t_event - T, 0)[:, None]
+			T = numpy.where(moving, t_event, T)
+
+			# Delayed reactions complete
+			cells = numpy.flatnonzero(moving & delayed)
+			done = c[cells]
+			head[cells, done] += 1
+			heads[cells, done] = numpy.where(tail[cells, done] > head[cells, done], queue[cells, done, head[cells, done] % capacity], inf)
+			X[cells, model.channel_species[done]] += rng.integers(low[done], high[done] + 1)
+
+			# Reactions fire and start delayed reactions
+			cells = numpy.flatnonzero(moving & ~delayed)
+			fired = j[cells]
+			Tk[cells, fired] = Pk[cells, fired]
+			Pk[cells, fired] += rng.standard_exponential(len(cells))
+			X[cells] += nu[fired]
+			for channel in numpy.flatnonzero(starts[fired].any(axis=0)):
+				starting = cells[starts[fired, channel]]
+				if (tail[starting, channel] - head[starting, channel] >= capacity).any():	# a queue is full, double them all
+					order = (head[:, :, None] + numpy.arange(capacity)) % capacity
+					queue = numpy.concatenate([numpy.take_along_axis(queue, order, axis=2), numpy.empty(queue.shape)], axis=2)
+					tail -= head
+					head[:] = 0
+					capacity *= 2
+				queue[starting, channel, tail[starting, channel] % capacity] = T[starting] + model.delays[channel]
+				first = tail[starting, channel] == head[starting, channel]
+				heads[starting[first], channel] = T[starting[first]] + model.delays[channel]
+				tail[starting, channel] += 1
+			a = model.propensities(X)
+		snapshots.append(population_table(X, model, template))
+	return snapshots
+
+SUMMARY = ["Pearson", "PearSig", "Spearman", "SpearSig", "Steps", "Time"]	# values kept for every run of an ensemble
+
+SAMPLED = ("mh1", "mh7")	# species sampled on the time grid of an ensemble
+
+CHECKPOINT_STEPS = 100000	# events between checks whether a checkpoint of a run is due
+
+worker_model = None	# model and run settings of the running ensemble, set once in every worker process
+worker_settings = None
+worker_samples = None	# memory-mapped samples of the running ensemble, opened once in every worker process
+
+def init_worker(model, settings):
+	global worker_model, worker_settings, worker_samples
+	worker_model = model
+	worker_settings = settings
+	samples_file = settings[4]
+	worker_samples = open_memmap(samples_file, mode='r+') if samples_file is not None else None
+
+def simulate_run(task): # one run of an ensemble, return its summary (and grid samples if they are not memory-mapped) only
+	run, seed = task
+	tend, maxi, directory, grid, samples_file, species, leap, stream, checkpoint = worker_settings
+	if stream:	# summaries of every event, without the trajectory
+		recorder = StreamRecorder(worker_model, species[:2], seed=seed.spawn(1)[0])
+	elif grid is None:	# every event, as the scenario scripts
+		recorder = EventRecorder(worker_model, species)
+	else:
+		recorder = GridRecorder(worker_model, grid, species, worker_samples[run] if worker_samples is not None else None)
+	simulation = Simulation(worker_model, numpy.random.default_rng(seed))
+	advance = simulation.run if leap is None else simulation.leap
+	options = leap or {}
+	if checkpoint is None:
+		advance(tend, maxi, recorder, **options)
+	else:	# stop every CHECKPOINT_STEPS events, and save the run if the last checkpoint is older than the interval
+		checkpoint_dir, interval, ensemble = checkpoint
+		checkpoint_file = checkpoint_dir + "/Run" + str(run + 1) + ".pkl"
+		state = load_checkpoint(checkpoint_file)
+		if state is not None and state.get("ensemble") != ensemble:
+			raise ValueError("the checkpoint " + checkpoint_file + " is of a run of an ensemble with other settings")
+		if state is not None:	# continue an interrupted run
+			simulation.restore(state["simulation"])
+			recorder = state["recorder"]
+			if grid is not None and worker_samples is not None:	# samples so far back into the memory map
+				worker_samples[run] = recorder.samples
+				recorder.samples = worker_samples[run]
+		saved = time.perf_counter()
+		while True:
+			advance(tend, maxi, recorder, pause=simulation.steps + CHECKPOINT_STEPS, **options)
+			if simulation.T >= tend or simulation.steps >= maxi - 1:
+				break
+			if time.perf_counter() - saved >= interval:
+				save_checkpoint(checkpoint_file, {"simulation": simulation.state(), "recorder": recorder, "ensemble": ensemble})
+				saved = time.perf_counter()
+		if os.path.isfile(checkpoint_file):
+			os.remove(checkpoint_file)
+	if stream:
+		recorder.buffer = recorder.buffer[:0]	# only the accumulators go back to the parent, flushed by finish()
+		return run, recorder.correlations() + (simulation.steps, simulation.T), recorder
+	mh1 = recorder.values("mh1")
+	mh7 = recorder.values("mh7")
+	samples = None
+	if grid is not None:
+		if worker_samples is not None:
+			worker_samples.flush()
+		else:
+			samples = recorder.samples
+		reached = ~numpy.isnan(mh1)
+		mh1 = mh1[reached]
+		mh7 = mh7[reached]
+	if directory is not None:	# write the trajectory from the worker
+		times = recorder.times if grid is None else recorder.grid[reached]
+		numpy.savez(directory + "/Run" + str(run + 1) + ".npz", Time=times, mh1=mh1, mh7=mh7)
+	return run, correlations(mh1, mh7) + (simulation.steps, simulation.T), samples
+
+def run_ensemble(model, nrun, seed = None, tend = 240, maxi = 10000000, processes = None, directory = None, grid = None, samples_file = None, species = SAMPLED, leap = None, stream = False, checkpoint = None, checkpoint_interval = 60): # nrun independent runs in a pool of worker processes
+	# Run i draws from the i-th stream spawned from SeedSequence(seed), so the results do not depend on the number of
+	# processes or on the order in which runs finish.
+	# directory: if given, every run writes its trajectory to <directory>/Run<i>.npz
+	# grid: if given, mh1 and mh7 are sampled at these times instead of after every event, and the correlations use the samples
+	# samples_file: .npy file that receives the samples through a memory map, so the parent never holds them
+	# species: species sampled, they must include mh1 and mh7
+	# leap: None for exact simulation, or a dict of Simulation.leap options (e.g. {"epsilon": 0.03}) for tau-leaping
+	# stream: summarize the events of every run with a StreamRecorder instead of recording them; the correlations then come
+	# from its accumulators, and the recorders of all runs are merged in run order. Not combined with a grid.
+	# checkpoint: directory for checkpoints, written at most every checkpoint_interval seconds: Ensemble.pkl holds the results
+	# of the finished runs, Run<i>.pkl the state of a run in progress. Calling run_ensemble again with the same arguments after
+	# an interruption continues from them, with the same results as an uninterrupted ensemble (even for seed None).
+	# Checkpoints of an ensemble with other settings, or of runs of one, raise ValueError instead of being resumed.
+	# Returns (summaries, samples, pooled): one row of SUMMARY values per run, the (runs, grid points, species) samples or None,
+	# and the merged StreamRecorder of all runs or None
+	if stream and grid is not None:
+		raise ValueError("streaming summaries are recorded per event, not on a grid")
+	if grid is not None:
+		grid = numpy.asarray(grid, dtype=float)
+	else:
+		samples_file = None
+	signature = {"nrun": nrun, "seed": seed, "tend": tend, "maxi": maxi, "grid": None if grid is None else grid.tolist(),
+		"species": tuple(species), "leap": leap, "stream": stream, "model": (model.species, model.initial.tolist(), model.rates.tolist(),
+		model.stoichiometry.tolist(), model.delays.tolist(), model.increments.tolist())}	# what the results depend on
+	state = None
+	if checkpoint is not None:
+		checkpoint = shared.ensureDir(checkpoint)
+		ensemble_file = checkpoint + "/Ensemble.pkl"
+		state = load_checkpoint(ensemble_file)
+		if state is not None and state["signature"] != signature:
+			raise ValueError("the checkpoint in " + checkpoint + " is of an ensemble with other settings")
+	if state is None:	# a new ensemble
+		state = {"signature": signature, "entropy": numpy.random.SeedSequence(seed).entropy, "done": numpy.zeros(nrun, dtype=bool),
+			"summaries": numpy.full((nrun, len(SUMMARY)), numpy.nan), "samples": None, "pooled": None, "merged": 0, "waiting": {}}
+		if grid is not None:
+			shape = (nrun, len(grid), len(species))
+			if samples_file is not None:
+				open_memmap(samples_file, mode='w+', dtype=float, shape=shape).flush()	# workers open the file themselves
+			else:
+				state["samples"] = numpy.full(shape, numpy.nan)
+		if checkpoint is not None:	# before any run starts, so run checkpoints are always matched by the ensemble they belong to
+			save_checkpoint(ensemble_file, state)
+	seeds = numpy.random.SeedSequence(state["entropy"]).spawn(nrun)
+	done = state["done"]
+	tasks = [(run, seeds[run]) for run in range(nrun) if not done[run]]
+	summaries = state["summaries"]
+	samples = state["samples"]
+	waiting = state["waiting"]	# recorders of runs that finished before an earlier run
+	ensemble = {"signature": signature, "entropy": state["entropy"]}	# stored in every run checkpoint, to be matched when it is resumed
+	settings = (tend, maxi, directory, grid, samples_file, tuple(species), leap, stream, None if checkpoint is None else (checkpoint, checkpoint_interval, ensemble))
+	if processes == 1:
+		init_worker(model, settings)
+		results = map(simulate_run, tasks)
+	else:
+		pool = Pool(processes, init_worker, (model, settings))
+		results = pool.imap_unordered(simulate_run, tasks)
+	saved = time.perf_counter()
+	try:
+		for run, summary, result in results:
+			summaries[run] = summary
+			if stream:	# merge in run order, so the pooled summaries do not depend on scheduling
+				waiting[run] = result
+				while state["merged"] in waiting:
+					recorder = waiting.pop(state["merged"])
+					state["pooled"] = recorder if state["pooled"] is None else state["pooled"].merge(recorder)
+					state["merged"] += 1
+			elif result is not None:
+				samples[run] = result
+			done[run] = True
+			if checkpoint is not None and (time.perf_counter() - saved >= checkpoint_interval or done.all()):
+				save_checkpoint(ensemble_file, state)
+				saved = time.perf_counter()
+	finally:
+		if processes != 1:
+			pool.close()
+			pool.join()
+	if samples_file is not None:
+		samples = open_memmap(samples_file, mode='r')	# the values written by the workers
+	return summaries, samples, state["pooled"]
+
+def leap_errors(model, nrun, grid, seed = None, tend = 240, processes = None, **options): # accuracy and speed of tau-leaping against the exact method
+	# Runs an exact and a tau-leaping ensemble (options are passed to Simulation.leap) and compares them on the grid, per species:
+	# the relative error of the mean over runs, and of the standard deviation over runs, both summed over the grid
+	# Returns (errors, exact_time, leap_time); errors maps every species to {"mean": error, "std": error}
+	# Both include the Monte Carlo error of nrun runs, compare with two exact ensembles of different seeds to judge them
+	species = tuple(model.species)
+	start = time.perf_counter()
+	summaries, exact, pooled = run_ensemble(model, nrun, seed, tend, processes=processes, grid=grid, species=species)
+	exact_time = time.perf_counter() - start
+	start = time.perf_counter()
+	summaries, leaped, pooled = run_ensemble(model, nrun, seed, tend, processes=processes, grid=grid, species=species, leap=options)
+	leap_time = time.perf_counter() - start
+	errors = {}
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		for i, name in enumerate(species):
+			errors[name] = {}
+			for key, statistic in [("mean", numpy.nanmean), ("std", numpy.nanstd)]:
+				reference = statistic(exact[:, :, i], axis=0)
+				errors[name][key] = float(numpy.nansum(numpy.abs(statistic(leaped[:, :, i], axis=0) - reference)) / numpy.nansum(numpy.abs(reference)))
+	return errors, exact_time, leap_time
+
+def write_correlations(filename, summaries): # one row of SUMMARY values per run, as <prefix>_PearsonSpearman.xlsx of the scripts
+	workbook = xlwt.Workbook(encoding="ascii")
+	worksheet = workbook.add_sheet("Correlations")
+	for column, label in enumerate(["Run"] + SUMMARY):
+		worksheet.write(0, column, label)
+	for i, row in enumerate(summaries):
+		worksheet.write(i + 1, 0, i + 1)
+		for column, value in enumerate(row):
+			worksheet.write(i + 1, column + 1, float(value))
+	workbook.save(filename)
+
+def main():
+	args = sys.argv[1:]
+	num_args = len(args)
+	scenario = 1
+	paired = True
+	nrun = 30
+	tend = 240
+	maxi = 10000000
+	trajectories = False
+	directory = None
+	seed = 1
+	processes = None
+	dt = None
+	leap = None
+	stream = False
+	interval = None
+	if num_args % 2 != 0:
+		usage()
+	for arg in range(0, num_args - 1, 2):
+		option = args[arg]
+		value = args[arg + 1]
+		if option == '-d' or option == '--output-directory':
+			directory = value
+		elif (option == '-s' or option == '--scenario') and shared.isInt(value) and int(value) in SCENARIOS:
+			scenario = int(value)
+		elif (option == '-g' or option == '--paired') and shared.isInt(value):
+			paired = int(value)==1
+		elif (option == '-r' or option == '--runs') and shared.isInt(value) and int(value) > 0:
+			nrun = int(value)
+		elif (option == '-t' or option == '--end-time') and shared.isFloat(value):
+			tend = float(value)
+		elif (option == '-mi' or option == '--max-iterations') and shared.isInt(value):
+			maxi = int(value)
+		elif (option == '-w' or option == '--write-trajectories') and shared.isInt(value):
+			trajectories = int(value)==1
+		elif (option == '-seed' or option == '--seed') and shared.isInt(value):
+			seed = int(value)
+		elif (option == '-p' or option == '--processes') and shared.isInt(value) and int(value) > 0:
+			processes = int(value)
+		elif (option == '-dt' or option == '--grid-spacing') and shared.isFloat(value) and float(value) > 0:
+			dt = float(value)
+		elif (option == '-tl' or option == '--tau-leaping') and shared.isFloat(value) and float(value) > 0:
+			leap = {"epsilon": float(value)}
+		elif (option == '-st' or option == '--stream') and shared.isInt(value):
+			stream = int(value)==1
+		elif (option == '-ck' or option == '--checkpoint-interval') and shared.isFloat(value) and float(value) >= 0:
+			interval = float(value)
+		else:
+			usage()
+	if directory is None or (stream and (dt is not None or trajectories)):
+		usage()
+	directory = shared.ensureDir(directory)
+
+	model = scenario_model(scenario, paired)
+	grid = None
+	samples_file = None
+	if dt is not None:	# sample onto a grid, memory-mapped to Samples.npy (runs x grid points x mh1/mh7)
+		grid = numpy.arange(0, tend + dt / 2, dt)
+		samples_file = directory + "/Samples.npy"
+		numpy.save(directory + "/Grid.npy", grid)
+	checkpoint = directory + "/checkpoint" if interval is not None else None	# running the same command again resumes from it
+	summaries, samples, pooled = run_ensemble(model, nrun, seed, tend, maxi, processes, directory if trajectories else None, grid, samples_file, SAMPLED, leap, stream, checkpoint, interval)
+	write_correlations(directory + "/PearsonSpearman.xls", summaries)
+	if pooled is not None:	# summaries of the events of all runs together
+		numpy.savez(directory + "/Summary.npz", species=numpy.array(pooled.species), count=pooled.moments.count, mean=pooled.moments.mean,
+			var=pooled.moments.var, correlations=numpy.array(pooled.correlations()), histogram=pooled.histogram.counts, edges=pooled.histogram.edges_a)
+	if checkpoint is not None:	# the results are written, the next run starts afresh
+		shutil.rmtree(checkpoint)
+
+def usage():
+	print("simulation.py: Invalid command-line arguments.")
+	print("Format: python simulation.py -d <output directory> -s <optional:scenario 1, 2 or 3> -g <optional:1 for paired (default), 0 for unpaired genes> -r <optional:number of runs, default 30> -t <optional:end time, default 240> -mi <optional:maximum number of iterations> -w <optional:1 to write the trajectory of every run> -seed <optional:master seed, default 1> -p <optional:number of worker processes> -dt <optional:sample mh1 and mh7 every dt minutes into Samples.npy instead of recording every event> -tl <optional:error control (e.g. 0.03) to use approximate tau-leaping> -st <optional:1 to summarize every event with streaming accumulators into Summary.npz instead of recording it, not with -dt or -w> -ck <optional:checkpoint at most every this many seconds into <output directory>/checkpoint, the same command then resumes an interrupted ensemble>")
+	print("Example: python simulation.py -d GenePaired -s 1 -g 1")
+	exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -16,6 +16,9 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import numpy
+from cells import CellTable
+
+EMPTY = CellTable([], [], [], [], [], [])	# table of every slice before its cells are set, shared so that creating a slice allocates none
 
 class Slice:
 	def __init__(self, top, bottom, top_left_xpos, top_right_xpos, bottom_left_xpos, bottom_right_xpos, last_slice):
@@ -28,39 +31,63 @@ class Slice:
 		self.slopeL = float("inf") if top_left_xpos == bottom_left_xpos else (top - bottom)/(top_left_xpos - bottom_left_xpos)
 		self.slopeR = float("inf") if top_right_xpos == bottom_right_xpos else (top - bottom)/(top_right_xpos - bottom_right_xpos)
 		self.last_slice = last_slice # whether this slice is the last (rightmost) slice in the region
-		self.cells = []
-		self.her1_levels = []
-		self.her7_levels = []
-		self.keep_cells = []
-		self.her1_bgNlevels = [] 	# background normalized her1 level
-		self.her7_bgNlevels = []	# background normalized her7 level
+		self.table = EMPTY	# CellTable holding the cells of this slice, set by set_cells
+		self.index = numpy.zeros(0, dtype=int)	# rows of self.table inside this slice
 		self.num_cells = 0
 		self.num_keep_cells = 0
 		self.valid = True # whether this slice is usable (i.e. has 3 or more cells)
 
-	def identify_cells(self, cell_list):
-		for cell in cell_list:
-			left_boundary = self.bottom_left_xpos + (cell.ypos - self.bottom)/self.slopeL
-			right_boundary = self.bottom_right_xpos + (cell.ypos - self.bottom)/self.slopeR
-			if (left_boundary <= cell.xpos if self.last_slice else left_boundary < cell.xpos) and cell.xpos <= right_boundary and self.bottom <= cell.ypos and cell.ypos <= self.top:
-				# Remain information from all cell for heatmap plotting visualization purpose
-				self.cells.append(cell)
-				self.her1_levels.append(cell.her1)
-				self.her7_levels.append(cell.her7)
-				
-				# Write background subtracted her value to slices.xls
-				self.keep_cells.append(cell)
-				self.her1_bgNlevels.append(cell.her1_bgN)
-				self.her7_bgNlevels.append(cell.her7_bgN)
-		self.num_cells = len(self.cells)
-		self.num_keep_cells = len(self.keep_cells)
+	def identify_cells(self, table, index = None):	# test the cells at the given rows of table against the slice boundaries
+		if index is None:
+			index = numpy.arange(len(table))
+		index = numpy.asarray(index, dtype=int)
+		xs = table.x[index]
+		ys = table.y[index]
+		left_boundary = self.bottom_left_xpos + (ys - self.bottom)/self.slopeL
+		right_boundary = self.bottom_right_xpos + (ys - self.bottom)/self.slopeR
+		inside = (left_boundary <= xs) if self.last_slice else (left_boundary < xs)
+		inside &= (xs <= right_boundary) & (self.bottom <= ys) & (ys <= self.top)
+		return self.set_cells(table, index[inside])
+
+	def set_cells(self, table, index):	# store the rows of table that fall inside this slice
+		self.table = table
+		self.index = index
+		self.num_cells = len(index)
+		self.num_keep_cells = len(index)
 		
 		# Ignore slices with fewer than 3 cells
 		if self.num_cells <= 2:
 			self.valid = False
 			return False
 
+		self.valid = True
 		return True
+
+	# Remain information from all cell for heatmap plotting visualization purpose
+	@property
+	def cells(self):
+		return self.table.cells(self.index)
+
+	@property
+	def her1_levels(self):
+		return self.table.her1[self.index]
+
+	@property
+	def her7_levels(self):
+		return self.table.her7[self.index]
+
+	# Write background subtracted her value to slices.xls
+	@property
+	def keep_cells(self):
+		return self.cells
+
+	@property
+	def her1_bgNlevels(self):	# background normalized her1 level
+		return self.table.her1_bgN(self.index)
+
+	@property
+	def her7_bgNlevels(self):	# background normalized her7 level
+		return self.table.her7_bgN(self.index)
 		
 	def slice_variance_her1(self):
 		return numpy.var(self.her1_levels) 
@@ -0,0 +1,347 @@
+"""
+Grouped statistics over labelled values, e.g. expression levels of cells labelled by slice
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy, math, statistics
+
+def grouped_moments(labels, values, num_groups, higher_moments = False): # count, mean, variance and std of every group for one or more variables at once
+	# labels: group (0 to num_groups-1) of every item; values: one row of item values per variable
+	# Variances are population variances (as numpy.var); NaN for empty groups
+	labels = numpy.asarray(labels, dtype=int)
+	values = numpy.atleast_2d(numpy.asarray(values, dtype=float))
+	num_vars = values.shape[0]
+	flat_labels = (labels + num_groups * numpy.arange(num_vars)[:, None]).ravel()	# one bincount covers every variable
+	size = num_vars * num_groups
+	count = numpy.bincount(labels, minlength=num_groups)
+	moments = {"count": count}
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		mean = numpy.bincount(flat_labels, values.ravel(), size).reshape(num_vars, num_groups) / count
+		deviation = values - mean[:, labels]
+		squared = deviation * deviation
+		var = numpy.bincount(flat_labels, squared.ravel(), size).reshape(num_vars, num_groups) / count
+		moments["mean"] = mean
+		moments["var"] = var
+		moments["std"] = numpy.sqrt(var)
+		moments["deviation"] = deviation	# values minus their group mean, for covariances
+		if higher_moments:
+			m3 = numpy.bincount(flat_labels, (squared * deviation).ravel(), size).reshape(num_vars, num_groups) / count
+			m4 = numpy.bincount(flat_labels, (squared * squared).ravel(), size).reshape(num_vars, num_groups) / count
+			moments["skewness"] = m3 / var**1.5
+			moments["kurtosis"] = m4 / (var * var) - 3	# excess kurtosis
+	return moments
+
+def grouped_covariance(labels, deviation_a, deviation_b, count): # population covariance of two variables in every group, from their deviations from the group means
+	num_groups = len(count)
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		return numpy.bincount(labels, deviation_a * deviation_b, num_groups) / count
+
+def slice_statistics(labels, num_slices, her1, her7, CB = 0.0, YB = 0.0, min_cells = 3, higher_moments = False, covariance = False): # statistics of every slice for raw and background normalized her1 and her7
+	# labels: slice of every cell (a cell in two slices appears twice); her1, her7: raw levels of those cells
+	# Slices with fewer than min_cells cells get NaN statistics
+	moments = grouped_moments(labels, [her1, her7], num_slices, higher_moments)
+	valid = moments["count"] >= min_cells
+	stats = {"num_cells": moments["count"], "valid": valid}
+	for i, (key, background) in enumerate([("her1", CB), ("her7", YB)]):
+		mean = numpy.where(valid, moments["mean"][i], numpy.nan)
+		var = numpy.where(valid, moments["var"][i], numpy.nan)
+		std = numpy.where(valid, moments["std"][i], numpy.nan)
+		stats[key + "_mean"] = mean
+		stats[key + "_var"] = var
+		stats[key + "_std"] = std
+		# Background normalization shifts every level by the same amount, so only the mean changes
+		stats[key + "_bgN_mean"] = mean - background
+		stats[key + "_bgN_var"] = var
+		stats[key + "_bgN_std"] = std
+		if higher_moments:
+			for moment in ["skewness", "kurtosis"]:
+				stats[key + "_" + moment] = numpy.where(valid, moments[moment][i], numpy.nan)
+				stats[key + "_bgN_" + moment] = stats[key + "_" + moment]
+	if covariance:
+		cov = grouped_covariance(labels, moments["deviation"][0], moments["deviation"][1], moments["count"])
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			corr = cov / (moments["std"][0] * moments["std"][1])
+		stats["her1_her7_cov"] = numpy.where(valid, cov, numpy.nan)
+		stats["her1_her7_corr"] = numpy.where(valid, corr, numpy.nan)
+	return stats
+
+def group_offsets(labels, num_groups): # order sorting items by group, group sizes, and position of every group's first item in that order
+	order = numpy.argsort(labels, kind='stable')
+	count = numpy.bincount(labels, minlength=num_groups)
+	offsets = numpy.zeros(num_groups, dtype=int)
+	numpy.cumsum(count[:-1], out=offsets[1:])
+	return order, count, offsets
+
+def bootstrap_moments(labels, values, num_groups, replicates = 1000, seed = None, max_block = 2**22): # means and variances of every group in bootstrap replicates
+	# Every replicate resamples the items of each group with replacement, for all groups at once: one (replicates x items)
+	# index matrix is drawn per block of replicates (bounded by max_block draws) and reduced with one bincount per variable.
+	# Returns (mean, var), each of shape (replicates, num_vars, num_groups); population variances, NaN for empty groups
+	labels = numpy.asarray(labels, dtype=int)
+	values = numpy.atleast_2d(numpy.asarray(values, dtype=float))
+	num_vars, num_items = values.shape
+	rng = numpy.random.default_rng(seed)
+	order, count, offsets = group_offsets(labels, num_groups)
+	labels = labels[order]
+	moments = grouped_moments(labels, values[:, order], num_groups)
+	deviation = moments["deviation"]	# resampling deviations from the group means keeps the variances accurate
+	first = offsets[labels]	# range of every item's group in the sorted items
+	size = count[labels]
+	mean = numpy.empty((replicates, num_vars, num_groups))
+	var = numpy.empty((replicates, num_vars, num_groups))
+	block = max(1, int(max_block / max(1, num_items)))
+	for start in range(0, replicates, block):
+		num = min(block, replicates - start)
+		draws = first + (rng.random((num, num_items)) * size).astype(int)	# every item replaced by a random item of its group
+		flat_labels = (labels + num_groups * numpy.arange(num)[:, None]).ravel()	# (replicate, group) of every draw
+		for v in range(num_vars):
+			drawn = deviation[v][draws].ravel()
+			with numpy.errstate(invalid='ignore', divide='ignore'):
+				shift = numpy.bincount(flat_labels, drawn, num * num_groups).reshape(num, num_groups) / count
+				square = numpy.bincount(flat_labels, drawn * drawn, num * num_groups).reshape(num, num_groups) / count
+			mean[start:start+num, v] = moments["mean"][v] + shift
+			var[start:start+num, v] = numpy.maximum(square - shift * shift, 0)
+	return mean, var
+
+def jackknife_moments(labels, values, num_groups): # mean and variance of every item's group without that item, from the group sums
+	# Returns (mean, var), each of shape (num_vars, num_items); population variances, NaN for groups of one item
+	labels = numpy.asarray(labels, dtype=int)
+	values = numpy.atleast_2d(numpy.asarray(values, dtype=float))
+	moments = grouped_moments(labels, values, num_groups)
+	deviation = moments["deviation"]	# sums of deviations from the group mean are 0, which keeps the variances accurate
+	count = moments["count"][labels]
+	flat_labels = (labels + num_groups * numpy.arange(values.shape[0])[:, None]).ravel()
+	square = numpy.bincount(flat_labels, (deviation * deviation).ravel(), values.shape[0] * num_groups).reshape(values.shape[0], num_groups)
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		shift = -deviation / (count - 1)
+		var = (square[:, labels] - deviation * deviation) / (count - 1) - shift * shift
+	return moments["mean"][:, labels] + shift, numpy.maximum(var, 0)
+
+def slice_intervals(labels, num_slices, her1, her7, CB = 0.0, YB = 0.0, method = "bootstrap", replicates = 1000, confidence = 0.95, seed = None, min_cells = 3):
+	# Confidence intervals of the slice means and variances of slice_statistics, as "<key>_low", "<key>_high" and the
+	# standard error "<key>_se" for the mean and var keys of her1, her7 and their background normalized levels
+	# method: "bootstrap" (percentile intervals of replicates resamplings, drawn from seed) or "jackknife" (normal
+	# intervals around the estimate, with the leave-one-out standard error); NaN for slices with fewer than min_cells cells
+	labels = numpy.asarray(labels, dtype=int)
+	values = numpy.array([her1, her7], dtype=float)
+	moments = grouped_moments(labels, values, num_slices)
+	valid = moments["count"] >= min_cells
+	estimates = {"mean": moments["mean"], "var": moments["var"]}
+	bounds = {}
+	if method == "bootstrap":
+		replicated = dict(zip(["mean", "var"], bootstrap_moments(labels, values, num_slices, replicates, seed)))
+		tail = 50 * (1 - confidence)
+		for statistic in estimates:
+			with numpy.errstate(invalid='ignore'):
+				low, high = numpy.percentile(replicated[statistic], [tail, 100 - tail], axis=0)
+			bounds[statistic] = (low, high, replicated[statistic].std(axis=0))
+	elif method == "jackknife":
+		z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+		count = moments["count"]
+		left_out = dict(zip(["mean", "var"], jackknife_moments(labels, values, num_slices)))
+		for statistic in estimates:
+			with numpy.errstate(invalid='ignore', divide='ignore'):
+				spread = grouped_moments(labels, left_out[statistic], num_slices)["var"]	# of the leave-one-out estimates
+				se = numpy.sqrt((count - 1) * spread)	# (n-1)/n times the sum of squared deviations
+			bounds[statistic] = (estimates[statistic] - z * se, estimates[statistic] + z * se, se)
+	else:
+		raise ValueError("unknown resampling method " + str(method))
+	intervals = {}
+	for i, (key, background) in enumerate([("her1", CB), ("her7", YB)]):
+		for statistic in ["mean", "var"]:
+			low, high, se = [numpy.where(valid, bound[i], numpy.nan) for bound in bounds[statistic]]
+			shift = background if statistic == "mean" else 0.0	# background normalization only moves the mean
+			for prefix, offset in [(key, 0.0), (key + "_bgN", shift)]:
+				intervals[prefix + "_" + statistic + "_low"] = low - offset
+				intervals[prefix + "_" + statistic + "_high"] = high - offset
+				intervals[prefix + "_" + statistic + "_se"] = se
+	return intervals
+
+def ranks(values): # ranks starting at 1, ties get their average rank
+	unique, inverse, counts = numpy.unique(values, return_inverse=True, return_counts=True)
+	ends = numpy.cumsum(counts)
+	return (ends - (counts - 1) / 2.0)[inverse]
+
+def correlation_p(r, n): # two-sided p-value of a correlation r of n pairs
+	# Uses the large-sample normal approximation of the t statistic, meant for long trajectories and large samples
+	if n < 3 or numpy.isnan(r):
+		return float("nan")
+	if abs(r) >= 1:
+		return 0.0
+	t = r * math.sqrt((n - 2) / (1 - r * r))
+	return math.erfc(abs(t) / math.sqrt(2))
+
+def correlation(a, b): # Pearson correlation of a and b, and its two-sided p-value
+	a = numpy.asarray(a, dtype=float)
+	b = numpy.asarray(b, dtype=float)
+	da = a - a.mean()
+	db = b - b.mean()
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		r = float(numpy.dot(da, db) / math.sqrt(numpy.dot(da, da) * numpy.dot(db, db)))
+	return r, correlation_p(r, len(a))
+
+# Streaming accumulators: add() takes a batch of values at a time, and merge() combines accumulators filled separately
+# (e.g. by different runs or worker processes) into the accumulator of all their values.
+
+class Moments: # running count, mean and variance of one or more variables (Chan et al. pairwise updates); NaN values are skipped
+	def __init__(self, shape = ()):
+		self.count = numpy.zeros(shape)
+		self.mean = numpy.zeros(shape)
+		self.m2 = numpy.zeros(shape)	# sum of squared deviations from the mean
+
+	def add(self, values): # values: one row per item, each row of the accumulator's shape
+		values = numpy.asarray(values, dtype=float)
+		count = (~numpy.isnan(values)).sum(axis=0)
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			mean = numpy.where(count > 0, numpy.nansum(values, axis=0) / count, 0)
+		m2 = numpy.nansum((values - mean) ** 2, axis=0)
+		self.combine(count, mean, m2)
+
+	def combine(self, count, mean, m2):
+		total = self.count + count
+		delta = mean - self.mean
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			weight = numpy.where(total > 0, count / total, 0)
+		self.mean = self.mean + delta * weight
+		self.m2 = self.m2 + m2 + delta * delta * self.count * weight
+		self.count = total
+
+	def merge(self, other):
+		self.combine(other.count, other.mean, other.m2)
+		return self
+
+	@property
+	def var(self): # population variance, NaN without values
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			return numpy.where(self.count > 0, self.m2 / self.count, numpy.nan)
+
+	@property
+	def std(self):
+		return numpy.sqrt(self.var)
+
+class CoMoments: # running means, variances and co-moment of two variables, for their Pearson correlation; pairs with a NaN are skipped
+	def __init__(self, shape = ()):
+		self.a = Moments(shape)
+		self.b = Moments(shape)
+		self.c = numpy.zeros(shape)	# sum of products of the deviations from the means
+
+	def add(self, a, b):
+		a = numpy.asarray(a, dtype=float)
+		b = numpy.asarray(b, dtype=float)
+		invalid = numpy.isnan(a) | numpy.isnan(b)
+		a = numpy.where(invalid, numpy.nan, a)
+		b = numpy.where(invalid, numpy.nan, b)
+		batch_a = Moments(self.c.shape)
+		batch_b = Moments(self.c.shape)
+		batch_a.add(a)
+		batch_b.add(b)
+		c = numpy.nansum((a - batch_a.mean) * (b - batch_b.mean), axis=0)
+		self.combine(batch_a, batch_b, c)
+
+	def combine(self, a, b, c):
+		total = self.a.count + a.count
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			weight = numpy.where(total > 0, a.count / total, 0)
+		self.c = self.c + c + (a.mean - self.a.mean) * (b.mean - self.b.mean) * self.a.count * weight
+		self.a.merge(a)
+		self.b.merge(b)
+
+	def merge(self, other):
+		self.combine(other.a, other.b, other.c)
+		return self
+
+	@property
+	def count(self):
+		return self.a.count
+
+	@property
+	def covariance(self): # population covariance
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			return numpy.where(self.count > 0, self.c / self.count, numpy.nan)
+
+	@property
+	def correlation(self): # Pearson correlation
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			return self.c / numpy.sqrt(self.a.m2 * self.b.m2)
+
+class Histogram2D: # counts of (a, b) pairs on fixed bin edges; values outside the edges are counted in the outermost bins
+	def __init__(self, edges_a, edges_b):
+		self.edges_a = numpy.asarray(edges_a, dtype=float)
+		self.edges_b = numpy.asarray(edges_b, dtype=float)
+		self.counts = numpy.zeros((len(self.edges_a) - 1, len(self.edges_b) - 1), dtype=numpy.int64)
+
+	def add(self, a, b):
+		num_a, num_b = self.counts.shape
+		i = numpy.clip(numpy.searchsorted(self.edges_a, a, 'right') - 1, 0, num_a - 1)
+		j = numpy.clip(numpy.searchsorted(self.edges_b, b, 'right') - 1, 0, num_b - 1)
+		self.counts += numpy.bincount(i * num_b + j, minlength=num_a * num_b).reshape(num_a, num_b)
+
+	def merge(self, other):
+		if not (numpy.array_equal(self.edges_a, other.edges_a) and numpy.array_equal(self.edges_b, other.edges_b)):
+			raise ValueError("histograms with different bin edges cannot be merged")
+		self.counts += other.counts
+		return self
+
+class Reservoir: # uniform random sample of at most `size` (a, b) pairs of a stream, for a Spearman correlation estimate
+	def __init__(self, size = 10000, seed = None):
+		self.size = size
+		self.seen = 0	# pairs added so far
+		self.a = numpy.empty(size)
+		self.b = numpy.empty(size)
+		self.rng = numpy.random.default_rng(seed)
+
+	@property
+	def filled(self):
+		return min(self.seen, self.size)
+
+	def add(self, a, b):
+		a = numpy.asarray(a, dtype=float)
+		b = numpy.asarray(b, dtype=float)
+		take = min(len(a), self.size - self.filled)	# fill the free slots first
+		self.a[self.filled:self.filled + take] = a[:take]
+		self.b[self.filled:self.filled + take] = b[:take]
+		self.seen += take
+		a, b = a[take:], b[take:]
+		if len(a) == 0:
+			return
+		# Algorithm R: the t-th pair replaces a random slot with probability size/t; later pairs win on repeated slots
+		slots = self.rng.integers(0, self.seen + numpy.arange(1, len(a) + 1))
+		keep = numpy.flatnonzero(slots < self.size)
+		unique, last = numpy.unique(slots[keep][::-1], return_index=True)
+		keep = keep[len(keep) - 1 - last]
+		self.a[slots[keep]] = a[keep]
+		self.b[slots[keep]] = b[keep]
+		self.seen += len(a)
+
+	def merge(self, other): # sample of the union: how many pairs come from each side follows the hypergeometric distribution
+		total = self.seen + other.seen
+		num = min(self.size, total)
+		if total == 0:
+			return self
+		from_self = int(self.rng.hypergeometric(self.seen, other.seen, num)) if self.seen > 0 and other.seen > 0 else (num if other.seen == 0 else 0)
+		mine = self.rng.choice(self.filled, from_self, replace=False)
+		theirs = self.rng.choice(other.filled, num - from_self, replace=False)
+		a = numpy.concatenate([self.a[mine], other.a[theirs]])
+		b = numpy.concatenate([self.b[mine], other.b[theirs]])
+		self.a = numpy.empty(self.size)
+		self.b = numpy.empty(self.size)
+		self.a[:num] = a
+		self.b[:num] = b
+		self.seen = total
+		return self
+
+	def spearman(self): # Spearman correlation of the sample, and its p-value for the sample size
+		a = self.a[:self.filled]
+		b = self.b[:self.filled]
+		return correlation(ranks(a), ranks(b))
@@ -0,0 +1,167 @@
+"""
+Evaluate a grid of slicing parameters (angle, delta angle, slice width) for one or more embryos
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys, os, itertools
+import numpy
+import shared
+import embryo_analysis
+from multiprocessing import Pool
+
+REGIONS = ["L", "R"]
+STATISTICS = ["num_cells", "her1_bgN_mean", "her1_bgN_var", "her7_bgN_mean", "her7_bgN_var"]	# per-slice values kept for every setting
+
+worker_embryos = None	# embryos of the running sweep, set once in every worker process
+
+def init_worker(embryos):
+	global worker_embryos
+	worker_embryos = embryos
+
+def evaluate_setting(task): # slice one embryo with one setting, return the per-slice statistics of every region
+	embryo, setting, angle, delta_angle, slice_width, statistics = task
+	analysis = embryo_analysis.analyze_embryo(worker_embryos[embryo], angle, delta_angle, slice_width=slice_width)
+	values = {}
+	for region in analysis.regions:
+		stats = analysis.slice_stats[region.name]
+		values[region.name] = numpy.array([stats[key] for key in statistics], dtype=float).T	# slices x statistics
+	return embryo, setting, values
+
+def sweep_embryos(embryos, angles, delta_angles, slice_widths = [8], statistics = STATISTICS, processes = None):
+	# embryos: CellTables, e.g. from embryo_analysis.load_cells; they are prepared (background, split) once and shared by all settings
+	# Returns (settings, results): settings is an array of (angle, delta_angle, slice_width) rows and results holds one array per
+	# embryo of shape (settings, regions, slices, statistics), padded with NaN where a setting gives fewer slices
+	embryos = [embryo_analysis.prepare_cells(cells) for cells in embryos]
+	settings = numpy.array(list(itertools.product(angles, delta_angles, slice_widths)), dtype=float)
+	tasks = []
+	for embryo in range(len(embryos)):
+		for setting in range(len(settings)):
+			angle, delta_angle, slice_width = settings[setting]
+			tasks.append((embryo, setting, angle, delta_angle, slice_width, statistics))
+
+	values = [[None] * len(settings) for cells in embryos]
+	if processes == 1:
+		init_worker(embryos)
+		for task in tasks:
+			embryo, setting, result = evaluate_setting(task)
+			values[embryo][setting] = result
+	else:
+		chunksize = max(1, int(len(tasks) / (8 * (processes or os.cpu_count() or 1))))
+		pool = Pool(processes, init_worker, (embryos,))	# every worker receives the embryos once, not with every task
+		try:
+			for embryo, setting, result in pool.imap_unordered(evaluate_setting, tasks, chunksize):
+				values[embryo][setting] = result
+		finally:
+			pool.close()
+			pool.join()
+
+	# Pack into one NaN padded array per embryo
+	results = []
+	for embryo in range(len(embryos)):
+		num_slices = 0
+		for result in values[embryo]:
+			for name in result:
+				num_slices = max(num_slices, len(result[name]))
+		packed = numpy.full((len(settings), len(REGIONS), num_slices, len(statistics)), numpy.nan)
+		for setting in range(len(settings)):
+			for name in values[embryo][setting]:
+				region_values = values[embryo][setting][name]
+				packed[setting, REGIONS.index(name), :len(region_values)] = region_values
+		results.append(packed)
+	return settings, results
+
+def sweep_embryo(cells, angles, delta_angles, slice_widths = [8], statistics = STATISTICS, processes = None): # sweep_embryos for a single embryo
+	settings, results = sweep_embryos([cells], angles, delta_angles, slice_widths, statistics, processes)
+	return settings, results[0]
+
+def parse_values(value): # comma separated numbers, or start:stop:count for evenly spaced numbers
+	if value.count(':') == 2:
+		start, stop, count = value.split(':')
+		return list(numpy.linspace(shared.toFlo(start), shared.toFlo(stop), shared.toInt(count)))
+	return [shared.toFlo(v) for v in value.split(',')]
+
+def main():
+	args = sys.argv[1:]
+	num_args = len(args)
+	req_args = [False] * 8
+	slice_widths = [8]
+	lr_shift = 0
+	ly_shift = 0
+	middle = 0
+	wholePSM = False
+	processes = None
+	if num_args >= 16 and num_args % 2 == 0:
+		for arg in range(0, num_args - 1, 2):
+			option = args[arg]
+			value = args[arg + 1]
+			if option == '-i' or option == '--input-file':
+				filename = value
+				req_args[0] = True
+			elif option == '-o' or option == '--output-file': # .npz file receiving settings and statistics
+				output = value
+				req_args[1] = True
+			elif option == '-a' or option == '--initial-angles':
+				angles = parse_values(value)
+				req_args[2] = True
+			elif option == '-dA' or option == '--delta-angles':
+				delta_angles = parse_values(value)
+				req_args[3] = True
+			elif (option == '-n' or option == '--num-sec') and shared.isInt(value):
+				num_sec = int(value)
+				req_args[4] = True
+			elif (option == '-m1' or option == '--background-noise-mean-her1') and shared.isFloat(value):
+				CB = float(value)
+				req_args[5] = True
+			elif (option == '-m7' or option == '--background-noise-mean-her7') and shared.isFloat(value):
+				YB = float(value)
+				req_args[6] = True
+			elif (option == '-f' or option == '--input-format') and shared.isInt(value):
+				in_format = int(value)==1
+				req_args[7] = True
+			elif option == '-sw' or option == '--slice-widths':
+				slice_widths = parse_values(value)
+			elif (option == '-s' or option == '--shift') and shared.isFloat(value):
+				lr_shift = float(value)
+			elif (option == '-w' or option == '--wholePSM') and shared.isInt(value):
+				wholePSM = int(value)==1
+			elif (option == '-ly' or option == '--left-yaxis-shift') and shared.isFloat(value):
+				ly_shift = float(value)
+			elif (option == '-m' or option == '--middle-section') and shared.isInt(value):
+				middle = int(value)
+			elif (option == '-p' or option == '--processes') and shared.isInt(value) and int(value) > 0:
+				processes = int(value)
+			else:
+				usage()
+		for arg in req_args:
+			if not arg:
+				usage()
+	else:
+		usage()
+
+	cells = embryo_analysis.load_cells(filename, num_sec, in_format, wholePSM, ly_shift, middle, CB, YB)
+	cells = embryo_analysis.prepare_cells(cells, lr_shift=lr_shift)
+	settings, results = sweep_embryos([cells], angles, delta_angles, slice_widths, STATISTICS, processes)
+	numpy.savez(output, settings=settings, stats=results[0], regions=numpy.array(REGIONS), statistics=numpy.array(STATISTICS))
+	print("sweep.py: " + str(len(settings)) + " settings written to " + output)
+
+def usage():
+	print("sweep.py: Invalid command-line arguments.")
+	print("Format: python sweep.py -i <input Excel file> -o <output .npz file> -a <initial angles> -dA <angle change rates> -n <number of sections> -m1 <background-noise-mean-her1> -m7 <background-noise-mean-her7> -f <0 or 1 to specify input format> -sw <optional:slice widths, default 8> -s <optional:half threshold shift> -w <optional:1 for lateral view> -ly <optional:left y-axis shift> -m <optional:middle sections> -p <optional:number of worker processes>")
+	print("Values for -a, -dA and -sw are comma separated (40,45,50) or start:stop:count (40:50:11).")
+	print("Example: python sweep.py -i wildtypefulldataset/WT1.xlsx -o WT1_sweep.npz -a 40:50:50 -dA 0:0.05:50 -n 2 -m1 0.019 -m7 0.076 -f 0")
+	exit(1)
+
+if __name__ == "__main__":
+	main()
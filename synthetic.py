@@ -0,0 +1,140 @@
+"""
+Generate synthetic embryos: input workbooks in the layouts read by embryo_analysis.py, or the CellTables read from them
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys
+import numpy
+import xlwt
+import shared
+import embryo_analysis
+
+XLS_ROWS = 65536	# rows and columns of an .xls worksheet
+XLS_COLUMNS = 256
+LABELS = ["ID", "x", "y", "z", "her1", "her7"]	# columns of a section block
+
+# Shape of the synthetic PSM: 1000 cells fill a WIDTH x HEIGHT rectangle; larger embryos grow in both directions, so the
+# cell density stays that of a real embryo
+WIDTH = 250.0
+HEIGHT = 200.0
+PERIOD = 60.0	# wavelength along x of the her1/her7 expression stripes
+EXPRESSION = 20.0	# mean mRNA count
+
+def synthetic_blocks(num_cells, num_sec = 2, in_format = 0, split = 0.5, middle = 0.0, seed = None): # raw cells of every section block of the worksheet
+	# split: fraction of the cells in the left (upper) half; middle: fraction of the cells in a middle section (input format 1 only)
+	# Returns (blocks, block_values, num_rows) as embryo_analysis.block_cells takes them; block_values hold the values of the
+	# worksheet, before the x positions are mirrored
+	rng = numpy.random.default_rng(seed)
+	scale = numpy.sqrt(num_cells / 1000.0)
+	width = WIDTH * scale / num_sec	# of a section
+	height = HEIGHT * scale
+	blocks = embryo_analysis.section_blocks(num_sec, in_format, middle=1 if in_format and middle > 0 else 0)
+	num_middle = int(round(num_cells * middle)) if in_format else 0
+	counts = numpy.diff(numpy.round(numpy.linspace(0, num_cells - num_middle, num_sec + 1)).astype(int))	# cells of every section
+	values = []
+	for first, section, side, y_shift in blocks:
+		if section == num_sec:	# middle section, across both halves
+			n = num_middle
+			x = rng.uniform(0, width, n)
+			y = rng.uniform(0, height, n)
+		elif not in_format:	# every section at the same x range, shift_and_split moves them apart and splits them at the middle y
+			n = counts[section]
+			x = rng.uniform(10, 10 + width, n)
+			y = numpy.where(rng.random(n) < split, rng.uniform(height / 2, height, n), rng.uniform(0, height / 2, n))
+		else:	# already shifted: sections side by side along x, left and right halves in separate blocks
+			n = int(round(counts[section] * (split if side == embryo_analysis.LEFT else 1 - split)))
+			x = rng.uniform(section * width, (section + 1) * width, n)
+			y = rng.uniform(height / 2, height, n) if side == embryo_analysis.LEFT else rng.uniform(0, height / 2, n)
+		z = rng.uniform(0, 50, n)
+		level = EXPRESSION * (1 + 0.5 * numpy.sin(2 * numpy.pi * x / PERIOD))	# stripes, so that slices differ
+		her1 = rng.poisson(level).astype(float)
+		her7 = rng.poisson(0.5 * level + 0.5 * her1).astype(float)	# correlated with her1
+		values.append([x, y, z, her1, her7])
+	num_rows = max([len(v[0]) for v in values] + [0])
+	block_values = []
+	for v in values:
+		keep = numpy.zeros(num_rows, dtype=bool)
+		keep[:len(v[0])] = True	# cells fill the top rows of a block
+		block_values.append((keep, v))
+	return blocks, block_values, num_rows
+
+def synthetic_cells(num_cells, num_sec = 2, in_format = 0, split = 0.5, middle = 0.0, seed = None, CB = 0.0, YB = 0.0): # the CellTable read_cells returns for the workbook write_workbook writes with the same arguments
+	blocks, block_values, num_rows = synthetic_blocks(num_cells, num_sec, in_format, split, middle, seed)
+	return embryo_analysis.block_cells(blocks, block_values, num_rows, num_sec, in_format, CB, YB)
+
+def write_workbook(filename, num_cells, num_sec = 2, in_format = 0, split = 0.5, middle = 0.0, seed = None): # write a synthetic embryo as an .xls input file
+	blocks, block_values, num_rows = synthetic_blocks(num_cells, num_sec, in_format, split, middle, seed)
+	if num_rows + 1 > XLS_ROWS or blocks[-1][0] + len(LABELS) > XLS_COLUMNS:
+		raise ValueError(str(num_cells) + " cells in " + str(len(blocks)) + " blocks do not fit in an .xls worksheet")
+	workbook = xlwt.Workbook(encoding="ascii")
+	worksheet = workbook.add_sheet("Sheet1")
+	for b in range(len(blocks)):
+		first = blocks[b][0]
+		for k in range(len(LABELS)):
+			worksheet.write(0, first + k, LABELS[k])
+		keep, values = block_values[b]
+		columns = [numpy.arange(1, len(values[0]) + 1).tolist()] + [v.tolist() for v in values]
+		for k in range(len(columns)):
+			for row, value in enumerate(columns[k]):
+				worksheet.write(row + 1, first + k, value)
+	workbook.save(filename)
+
+def main():
+	args = sys.argv[1:]
+	num_args = len(args)
+	filename = None
+	num_cells = 1000
+	num_sec = 2
+	in_format = 0
+	split = 0.5
+	middle = 0.0
+	seed = None
+	if num_args % 2 != 0:
+		usage()
+	for arg in range(0, num_args - 1, 2):
+		option = args[arg]
+		value = args[arg + 1]
+		if option == '-o' or option == '--output-file':
+			filename = value
+		elif (option == '-c' or option == '--cells') and shared.isInt(value) and int(value) > 0:
+			num_cells = int(value)
+		elif (option == '-n' or option == '--num-sec') and shared.isInt(value) and int(value) > 0:
+			num_sec = int(value)
+		elif (option == '-f' or option == '--input-format') and shared.isInt(value):
+			in_format = int(value)==1
+		elif (option == '-sp' or option == '--split') and shared.isFloat(value) and 0 <= float(value) <= 1:
+			split = float(value)
+		elif (option == '-m' or option == '--middle-section') and shared.isFloat(value) and 0 <= float(value) < 1:
+			middle = float(value)
+		elif (option == '-seed' or option == '--seed') and shared.isInt(value):
+			seed = int(value)
+		else:
+			usage()
+	if filename is None:
+		usage()
+	try:
+		write_workbook(filename, num_cells, num_sec, in_format, split, middle, seed)
+	except ValueError as e:
+		print("synthetic.py: " + str(e))
+		exit(1)
+
+def usage():
+	print("synthetic.py: Invalid command-line arguments.")
+	print("Format: python synthetic.py -o <output .xls file> -c <optional:number of cells, default 1000> -n <optional:number of sections, default 2> -f <optional:0 or 1 to specify input format> -sp <optional:fraction of cells in the left half, default 0.5> -m <optional:fraction of cells in a middle section, input format 1 only> -seed <optional:random seed>")
+	print("Example: python synthetic.py -o synthetic.xls -c 5000 -n 2 -f 0, then python embryo_analysis.py -i synthetic.xls -n 2 -f 0 ...")
+	exit(1)
+
+if __name__ == "__main__":
+	main()
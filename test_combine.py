@@ -0,0 +1,66 @@
+"""
+Tests of combine.SliceProfiles pooling embryos with different numbers of slices
+"""
+import pytest
+numpy = pytest.importorskip("numpy")
+import combine
+
+def embryo(num_slices, seed): # embryo_slices of a single region "L", every slice valid
+	rng = numpy.random.default_rng(seed)
+	slices = {"num_cells": rng.integers(3, 20, num_slices)}
+	for variable in combine.VARIABLES:
+		slices[variable + "_mean"] = rng.uniform(1, 10, num_slices)
+		slices[variable + "_var"] = rng.uniform(0.5, 5, num_slices)
+	return {"L": slices}
+
+def expected_pooled(embryos, num_slices, variable): # pooled count, mean and variance of every slice position, from all embryos at once
+	count = numpy.zeros(num_slices)
+	total = numpy.zeros(num_slices)
+	squares = numpy.zeros(num_slices)
+	for slices in embryos:
+		columns = slices["L"]
+		n = len(columns["num_cells"])
+		mean = columns[variable + "_mean"]
+		count[:n] += columns["num_cells"]
+		total[:n] += columns["num_cells"] * mean
+		squares[:n] += columns["num_cells"] * (columns[variable + "_var"] + mean * mean)
+	mean = total / count
+	return count, mean, squares / count - mean * mean
+
+@pytest.mark.parametrize("sizes", [[5, 6, 4], [4, 6, 5], [6, 5, 4], [3, 3, 7]])
+def test_add_embryos_with_different_slice_counts(sizes):
+	embryos = [embryo(size, seed) for seed, size in enumerate(sizes)]
+	profiles = combine.SliceProfiles()
+	for slices in embryos:
+		profiles.add(slices)
+	columns = profiles.profiles()["L"]
+	num_slices = max(sizes)
+	assert len(columns["slice"]) == num_slices
+	assert profiles.num_embryos == len(sizes)
+	assert list(columns["num_embryos"]) == [sum(size > i for size in sizes) for i in range(num_slices)]
+	for variable in combine.VARIABLES:
+		count, mean, var = expected_pooled(embryos, num_slices, variable)
+		assert numpy.array_equal(columns["num_cells"], count.astype(int))
+		assert numpy.allclose(columns[variable + "_pooled_mean"], mean)
+		assert numpy.allclose(columns[variable + "_pooled_var"], var)
+
+def test_merge_profiles_with_different_slice_counts():
+	embryos = [embryo(size, seed) for seed, size in enumerate([7, 4, 5, 3, 6])]
+	sequential = combine.SliceProfiles()
+	for slices in embryos:
+		sequential.add(slices)
+	narrow = combine.SliceProfiles()	# fewer slices than the profiles it is merged into, and the other way around
+	wide = combine.SliceProfiles()
+	for slices in embryos[1:4]:
+		narrow.add(slices)
+	for slices in [embryos[0], embryos[4]]:
+		wide.add(slices)
+	for merged in [combine.SliceProfiles().merge(narrow).merge(wide), combine.SliceProfiles().merge(wide).merge(narrow)]:
+		assert merged.num_embryos == len(embryos)
+		expected = sequential.profiles()["L"]
+		columns = merged.profiles()["L"]
+		for key in expected:
+			if key == "region":
+				assert list(columns[key]) == list(expected[key])
+			else:
+				assert numpy.allclose(columns[key], expected[key], equal_nan=True)
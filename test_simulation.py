@@ -0,0 +1,50 @@
+"""
+Tests of resuming checkpointed simulation ensembles
+"""
+import os
+import pytest
+numpy = pytest.importorskip("numpy")
+import simulation
+
+def run_checkpoint(model, seed, steps, ensemble = None): # Run<i>.pkl contents of a run interrupted after the given number of events
+	run = simulation.Simulation(model, numpy.random.default_rng(seed))
+	recorder = simulation.EventRecorder(model, simulation.SAMPLED)
+	run.run(30, 10000000, recorder, pause=steps)
+	state = {"simulation": run.state(), "recorder": recorder}
+	if ensemble is not None:
+		state["ensemble"] = ensemble
+	return state
+
+def test_stale_run_checkpoint_without_ensemble_is_rejected(tmp_path):
+	# An interrupted first attempt of a scenario 3 ensemble left Run1.pkl behind, but no Ensemble.pkl
+	checkpoint = str(tmp_path / "checkpoint")
+	os.makedirs(checkpoint)
+	simulation.save_checkpoint(checkpoint + "/Run1.pkl", run_checkpoint(simulation.scenario_model(3), 5, 3000))
+	with pytest.raises(ValueError):
+		simulation.run_ensemble(simulation.scenario_model(1), 2, seed=1, tend=30, processes=1, checkpoint=checkpoint)
+	assert os.path.isfile(checkpoint + "/Ensemble.pkl")	# written before the runs started
+
+def test_run_checkpoint_of_other_settings_is_rejected(tmp_path):
+	checkpoint = str(tmp_path / "checkpoint")
+	model = simulation.scenario_model(1)
+	simulation.run_ensemble(model, 2, seed=1, tend=30, processes=1, checkpoint=checkpoint)
+	ensemble = simulation.load_checkpoint(checkpoint + "/Ensemble.pkl")
+	os.remove(checkpoint + "/Ensemble.pkl")
+	simulation.save_checkpoint(checkpoint + "/Run1.pkl", run_checkpoint(model, 5, 3000, {"signature": ensemble["signature"], "entropy": ensemble["entropy"]}))
+	with pytest.raises(ValueError):
+		simulation.run_ensemble(model, 2, seed=2, tend=30, processes=1, checkpoint=checkpoint)
+
+def test_resumed_run_matches_uninterrupted_run(tmp_path):
+	model = simulation.scenario_model(1)
+	expected = simulation.run_ensemble(model, 2, seed=1, tend=30, processes=1)[0]
+	checkpoint = str(tmp_path / "checkpoint")
+	simulation.run_ensemble(model, 2, seed=1, tend=30, processes=1, checkpoint=checkpoint)
+	ensemble = simulation.load_checkpoint(checkpoint + "/Ensemble.pkl")
+	ensemble["done"][0] = False	# as if interrupted during the first run, after its checkpoint
+	ensemble["summaries"][0] = numpy.nan
+	simulation.save_checkpoint(checkpoint + "/Ensemble.pkl", ensemble)
+	seeds = numpy.random.SeedSequence(ensemble["entropy"]).spawn(2)
+	simulation.save_checkpoint(checkpoint + "/Run1.pkl", run_checkpoint(model, seeds[0], 3000, {"signature": ensemble["signature"], "entropy": ensemble["entropy"]}))
+	summaries = simulation.run_ensemble(model, 2, seed=1, tend=30, processes=1, checkpoint=checkpoint)[0]
+	assert numpy.array_equal(summaries, expected)
+	assert not os.path.isfile(checkpoint + "/Run1.pkl")
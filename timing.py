@@ -0,0 +1,143 @@
+"""
+Opt-in per-stage timing: wall time, CPU time, peak memory and item counts of the stages of an embryo analysis
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys, time, json, tracemalloc
+try:
+	import resource	# process peak memory, not available on Windows
+except ImportError:
+	resource = None
+
+TIMING = "timing.json"	# record of one embryo, written to its output directory
+
+def peak_rss(): # peak resident memory of this process so far, in bytes (None if unknown)
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak if sys.platform == "darwin" else peak * 1024	# kilobytes except on macOS
+
+class Stage: # one timed run of a stage, see Recorder.stage
+	def __init__(self, recorder, name):
+		self.recorder = recorder
+		self.name = name
+		self.counts = {}
+
+	def count(self, **counts): # add item counts (cells, slices, cells written, ...) to the stage
+		for key in counts:
+			self.counts[key] = self.counts.get(key, 0) + int(counts[key])
+
+	def __enter__(self):
+		if self.recorder.trace_memory:
+			self.traced = tracemalloc.get_traced_memory()[0]
+			tracemalloc.reset_peak()
+		self.cpu = time.process_time()
+		self.wall = time.perf_counter()
+		return self
+
+	def __exit__(self, kind, value, trace):
+		wall = time.perf_counter() - self.wall
+		cpu = time.process_time() - self.cpu
+		traced = tracemalloc.get_traced_memory()[1] - self.traced if self.recorder.trace_memory else None
+		self.recorder.add(self.name, wall, cpu, traced, self.counts)
+		return False
+
+class NullStage: # stage of the NULL recorder, records nothing
+	def count(self, **counts):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, kind, value, trace):
+		return False
+
+NULL_STAGE = NullStage()
+
+class Recorder: # stages of one embryo (or batch), in the order they first ran
+	# Stages of the same name, such as the slicing of the left and right regions, are added up into one entry.
+	# Stages should not be nested when trace_memory is set, as each stage resets the traced peak.
+	def __init__(self, name = None, trace_memory = False):
+		self.name = name
+		self.trace_memory = trace_memory
+		self.stages = {}
+		if trace_memory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+
+	def stage(self, name): # context manager timing one run of the named stage
+		return Stage(self, name)
+
+	def add(self, name, wall, cpu, traced, counts):
+		if name not in self.stages:
+			self.stages[name] = {"stage": name, "calls": 0, "wall": 0.0, "cpu": 0.0, "peak_rss": None, "peak_traced": None, "counts": {}}
+		entry = self.stages[name]
+		entry["calls"] += 1
+		entry["wall"] += wall
+		entry["cpu"] += cpu
+		entry["peak_rss"] = peak_rss()
+		if traced is not None:
+			entry["peak_traced"] = max(entry["peak_traced"] or 0, traced)
+		for key in counts:
+			entry["counts"][key] = entry["counts"].get(key, 0) + counts[key]
+
+	def record(self): # JSON-serializable record of every stage and their totals
+		stages = list(self.stages.values())
+		return {"embryo": self.name, "stages": stages, "wall": sum(s["wall"] for s in stages), "cpu": sum(s["cpu"] for s in stages), "peak_rss": peak_rss()}
+
+	def save(self, filename):
+		with open(filename, "w") as f:
+			json.dump(self.record(), f, indent=1)
+
+class NullRecorder: # recorder used while timing is off, so instrumented code costs one method call per stage
+	trace_memory = False
+
+	def stage(self, name):
+		return NULL_STAGE
+
+NULL = NullRecorder()
+
+def load_record(filename):
+	with open(filename) as f:
+		return json.load(f)
+
+def aggregate(records): # totals of every stage over the records of many embryos, and the slowest embryos
+	stages = {}
+	for record in records:
+		for entry in record["stages"]:
+			name = entry["stage"]
+			if name not in stages:
+				stages[name] = {"stage": name, "embryos": 0, "wall": 0.0, "wall_max": 0.0, "cpu": 0.0, "peak_rss_max": None, "peak_traced_max": None, "counts": {}}
+			total = stages[name]
+			total["embryos"] += 1
+			total["wall"] += entry["wall"]
+			total["wall_max"] = max(total["wall_max"], entry["wall"])
+			total["cpu"] += entry["cpu"]
+			for key in ["peak_rss", "peak_traced"]:
+				if entry[key] is not None:
+					total[key + "_max"] = max(total[key + "_max"] or 0, entry[key])
+			for key in entry["counts"]:
+				total["counts"][key] = total["counts"].get(key, 0) + entry["counts"][key]
+	for total in stages.values():
+		total["wall_mean"] = total["wall"] / total["embryos"]
+	slowest = sorted(records, key=lambda record: record["wall"], reverse=True)
+	return {"embryos": len(records), "stages": list(stages.values()), "wall": sum(r["wall"] for r in records),
+		"cpu": sum(r["cpu"] for r in records), "slowest": [(r["embryo"], r["wall"]) for r in slowest[:5]]}
+
+def summary(totals): # lines of text reporting aggregate() totals
+	lines = []
+	for total in totals["stages"]:
+		counts = ", ".join(str(total["counts"][key]) + " " + key for key in sorted(total["counts"]))
+		lines.append("%-12s %9.3f s wall %9.3f s cpu  (max %.3f s per embryo)  %s" % (total["stage"], total["wall"], total["cpu"], total["wall_max"], counts))
+	return lines
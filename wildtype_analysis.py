@@ -15,8 +15,11 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
+import sys, os, json, traceback
 import xlrd
-from subprocess import call
+import shared
+import embryo_analysis, plotting, timing, combine
+from multiprocessing import Pool
 
 ############ THE FOLLOWING VALUES CAN BE CHANGED IF THE INPUT VALUES ARE CHANGED
 
@@ -27,49 +30,179 @@ folderOut = '../wildtype/output'
 ## Reading embryo information from SampleInfo.xlsx and create  arrays - modified by leeyy
 sampleInfo = folderIn + "/SampleInfo.xlsx" # named information file as "SampleInfo.xlsx" and put it at input folder
 
-workbook = xlrd.open_workbook(sampleInfo,'r')
-worksheet = workbook.sheet_by_name("Sheet1")
-file_len = worksheet.nrows
-
-num_embryos = file_len - 1
-left_angles = [None] * num_embryos
-right_angles = [None] * num_embryos
 angle = 46.543          # The y intercept of angle line
 delta_angle = 0.0328    # The slope of angle line
-CB = [None] * num_embryos
-VARCB = [None] * num_embryos
-YB = [None] * num_embryos
-VARYB = [None] * num_embryos
-
-for j in range(1, file_len): # skipped first line
-    row = list(worksheet.row(j))    
-    left_angles[j-1] = 180 + row[2].value   #column3: L angle
-    right_angles[j-1] = row[3].value - 180  #column4: R angle
-    CB[j-1] = row[4].value                  #column5: mean somite farred (HER1)
-    VARCB[j-1] = row[6].value               #column7: somite variance farred (HER1)
-    YB[j-1] = row[5].value                  #column6: mean somite red (HER7)
-    VARYB[j-1] = row[7].value               #column8: somite variance red (HER7)
-    
-    
+
+def read_sample_info(filename): # read angles and background noise of every embryo from SampleInfo.xlsx
+	workbook = xlrd.open_workbook(filename,'r')
+	worksheet = workbook.sheet_by_name("Sheet1")
+	file_len = worksheet.nrows
+
+	num_embryos = file_len - 1
+	left_angles = [None] * num_embryos
+	right_angles = [None] * num_embryos
+	CB = [None] * num_embryos
+	VARCB = [None] * num_embryos
+	YB = [None] * num_embryos
+	VARYB = [None] * num_embryos
+
+	for j in range(1, file_len): # skipped first line
+		row = list(worksheet.row(j))    
+		left_angles[j-1] = 180 + row[2].value   #column3: L angle
+		right_angles[j-1] = row[3].value - 180  #column4: R angle
+		CB[j-1] = row[4].value                  #column5: mean somite farred (HER1)
+		VARCB[j-1] = row[6].value               #column7: somite variance farred (HER1)
+		YB[j-1] = row[5].value                  #column6: mean somite red (HER7)
+		VARYB[j-1] = row[7].value               #column8: somite variance red (HER7)
+	return num_embryos, left_angles, right_angles, CB, VARCB, YB, VARYB
+
+def run_embryo(args): # run embryo_analysis.py with the given arguments in this process, return an error message instead of stopping
+	# Returns (args, error message or None, slice statistics for combine.SliceProfiles or None)
+	try:
+		analysis = embryo_analysis.main(args)
+	except SystemExit as e:	# embryo_analysis.py exits on invalid arguments or missing files
+		if e.code not in (None, 0):
+			return (args, "embryo_analysis.py exited with status " + str(e.code), None)
+		return (args, None, None)
+	except Exception:
+		return (args, traceback.format_exc(), None)
+	return (args, None, combine.embryo_slices(analysis))
+
+def run_batch(commands, processes = None, profiles = None): # run every embryo in a pool of worker processes, which stay alive across embryos
+	# profiles: combine.SliceProfiles receiving the slice statistics of every embryo as it finishes
+	errors = []	# (arguments, error message) of every embryo that failed
+	pool = Pool(processes)
+	try:
+		for args, error, slices in pool.imap_unordered(run_embryo, commands):
+			if error is not None:
+				errors.append((args, error))
+			elif slices is not None and profiles is not None:
+				profiles.add(slices)
+	finally:
+		pool.close()
+		pool.join()
+	return errors
+
+MANIFEST = "manifest.json"	# written to each embryo output directory after a successful run
+
+def embryo_manifest(args, sample_row): # everything the outputs of one embryo depend on: input file contents, SampleInfo row and analysis arguments
+	filename = args[args.index('-i') + 1]
+	return {"input_file": filename, "input_sha1": embryo_analysis.file_hash(filename), "sample_info": list(sample_row), "arguments": list(args)}
+
+def is_up_to_date(directory, manifest): # whether the outputs in directory were produced from exactly the inputs in manifest
+	if not os.path.isfile(directory + "/slices.xls"):
+		return False
+	try:
+		with open(directory + "/" + MANIFEST) as f:
+			return json.load(f) == manifest
+	except (IOError, ValueError):
+		return False
+
+def write_manifest(directory, manifest):
+	with open(directory + "/" + MANIFEST, "w") as f:
+		json.dump(manifest, f, indent=1)
+
+def write_timing(directories, recorder): # add up the timing records of the embryos in directories into timing.json of the output folder
+	records = [timing.load_record(directory + "/" + timing.TIMING) for directory in directories if os.path.isfile(directory + "/" + timing.TIMING)]
+	totals = timing.aggregate(records)
+	totals["batch"] = recorder.record()
+	with open(shared.ensureDir(folderOut) + "/" + timing.TIMING, "w") as f:
+		json.dump(totals, f, indent=1)
+	print('Stage timing of ' + str(totals["embryos"]) + ' embryos:')
+	for line in timing.summary(totals):
+		print('  ' + line)
+
 def main():
-	commands = [] # list of commands for running embryo_analysis.py for each embryo
-	slices_files = [] # list of slices.xls files from all embryos needed for combine_embryos.py
-	# Putting commands into array commands, to be called later. If you change the name of input files, please modify
+	args = sys.argv[1:]
+	processes = None	# number of worker processes, one per core by default
+	force = False	# reprocess embryos whose inputs did not change
+	plot = False	# draw the expression histograms of the analyzed embryos once all of them are done
+	intervals = []	# embryo_analysis.py arguments for confidence intervals of the slice statistics
+	timed = 0	# 1 to record the stages of every embryo and add them up in timing.json of the output folder, 2 to also trace memory
+	if len(args) % 2 != 0:
+		usage()
+	for arg in range(0, len(args) - 1, 2):
+		option = args[arg]
+		value = args[arg + 1]
+		if (option == '-p' or option == '--processes') and shared.isInt(value) and int(value) > 0:
+			processes = int(value)
+		elif (option == '-F' or option == '--force') and shared.isInt(value):
+			force = int(value)==1
+		elif (option == '-P' or option == '--plot') and shared.isInt(value):
+			plot = int(value)==1
+		elif (option == '-ci' or option == '--intervals') and value in ["bootstrap", "jackknife"]:
+			intervals += ['-ci', value]
+		elif (option == '-br' or option == '--replicates') and shared.isInt(value) and int(value) > 0:
+			intervals += ['-br', value]
+		elif (option == '-T' or option == '--timing') and shared.isInt(value) and int(value) in [0, 1, 2]:
+			timed = int(value)
+		else:
+			usage()
+
+	num_embryos, left_angles, right_angles, CB, VARCB, YB, VARYB = read_sample_info(sampleInfo)
+	commands = [] # list of arguments for running embryo_analysis.py for each embryo
+	skipped = [] # output directories of the embryos whose outputs are up to date
+	# Putting arguments into array commands, to be run later. If you change the name of input files, please modify
 	# using the "-i" flag
 	# Comment starting here if you want to skip embryo_analysis.py
 	
+	manifests = {} # output directory -> manifest of the embryos to run
 	for i in range(1,num_embryos+1):
-		commands.append(['python','embryo_analysis.py','-i',folderIn+'/WT'+str(i)+'.xlsx','-d',folderOut+'/embryo'+str(i),'-a',str(angle),'-dA',str(delta_angle),'-n','2','-f','0','-m1',str(CB[i-1]),'-m7',str(YB[i-1])])
+		args = ['-i',folderIn+'/WT'+str(i)+'.xlsx','-d',folderOut+'/embryo'+str(i),'-a',str(angle),'-dA',str(delta_angle),'-n','2','-f','0','-m1',str(CB[i-1]),'-m7',str(YB[i-1]),'-pl',str(embryo_analysis.PLOT_LATER)]	# histograms are drawn after the batch, if at all
+		if '-ci' in intervals:	# every embryo resamples from its own seed
+			args += intervals + ['-seed', str(i)]
+		if os.path.isfile(args[1]):	# missing inputs are left to embryo_analysis.py to report
+			sample_row = [left_angles[i-1], right_angles[i-1], CB[i-1], VARCB[i-1], YB[i-1], VARYB[i-1]]
+			manifests[args[3]] = embryo_manifest(args, sample_row)
+			if not force and is_up_to_date(args[3], manifests[args[3]]):
+				skipped.append(args[3])
+				continue
+		if timed:	# not part of the manifest, timing does not change the outputs
+			args += ['-t', str(timed)]
+		commands.append(args)
 	# Process raw input data
-	print('Analyzing wildtype embryos...')
-	for command in commands:
-		if 1==call(command):
-			exit(1)
+	print('Analyzing wildtype embryos... (' + str(num_embryos - len(commands)) + ' unchanged embryos skipped)')
+	recorder = timing.Recorder(folderOut) if timed else timing.NULL	# the batch as a whole
+	errors = []
+	profiles = combine.SliceProfiles()	# slices of all embryos pooled by slice position, streamed from the workers
+	if len(commands) > 0:
+		with recorder.stage("analyze") as stage:
+			errors = run_batch(commands, processes, profiles)
+			stage.count(embryos=len(commands))
+	failed = [args[3] for args, error in errors]
+	for args in commands:
+		if args[3] not in failed and args[3] in manifests:
+			write_manifest(args[3], manifests[args[3]])
+	done = [args[3] for args in commands if args[3] not in failed]
+	if plot and len(done) > 0:
+		print('Plotting expression histograms...')
+		with recorder.stage("plot") as stage:
+			for directory, error in plotting.render_batch(done, processes):
+				print("WT_analysis.py: plotting " + directory + " failed: " + error)
+			stage.count(embryos=len(done))
+	# Pool the slices of all embryos; unchanged embryos were not rerun, so their slices are read back from their outputs
+	with recorder.stage("combine") as stage:
+		profiles.merge(combine.combine_directories(skipped))
+		if profiles.num_embryos > 0:
+			combine.write_profiles(shared.ensureDir(folderOut) + "/" + combine.COMBINED, profiles.profiles())
+		stage.count(embryos=profiles.num_embryos)
+	if timed and len(done) > 0:
+		write_timing(done, recorder)
+	for args, error in errors:
+		print("WT_analysis.py: " + args[3] + " failed:")
+		print(error)
+	if len(errors) > 0:
+		print("WT_analysis.py: " + str(len(errors)) + " of " + str(len(commands)) + " embryos failed.")
+		exit(1)
 	
 	# Comment ending here if you want to skip embryo_analysis.py
-	for i in range(1, num_embryos + 1):
-		slices_files.append(folderOut+'/embryo'+str(i)+'/slices.xls')
-
 
 	print('WT_analysis.py: Done.')
-main()
+
+def usage():
+	print("wildtype_analysis.py: Invalid command-line arguments.")
+	print("Format: python wildtype_analysis.py -p <optional:number of worker processes, default one per core> -F <optional:1 to reprocess embryos whose inputs did not change> -P <optional:1 to plot the expression histograms> -ci <optional:bootstrap or jackknife confidence intervals> -br <optional:bootstrap replicates, default 1000> -T <optional:1 to record the time of every stage in timing.json, 2 to also trace memory>")
+	exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,121 @@
+"""
+Write slice summaries and per-cell slice membership in long (tidy) form, as an alternative to the Excel sheets
+Every backend writes three tables to the output directory, one row per item and one column per value:
+	cells:   every cell of every region, with the slice it belongs to (0 if none)
+	slices:  every slice of every region, with its corners and statistics (NaN for slices with fewer than 3 cells)
+	members: every (slice, cell) pair, with raw and background normalized expression levels
+Slice numbers start at 1 as in the Excel sheets; "cell" is the row of the cell in the embryo's CellTable.
+
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import csv, importlib.util
+import numpy
+
+STATISTICS = ["her1_mean","her1_var","her1_std","her7_mean","her7_var","her7_std",
+	"her1_bgN_mean","her1_bgN_var","her1_bgN_std","her7_bgN_mean","her7_bgN_var","her7_bgN_std"]
+
+def cell_columns(region): # columns of the cells table for one region
+	cells = region.cells
+	columns = {}
+	columns["region"] = numpy.full(len(region.index), region.name)
+	columns["cell"] = region.index
+	columns["xpos"] = cells.x[region.index]
+	columns["ypos"] = cells.y[region.index]
+	columns["zpos"] = cells.z[region.index]
+	columns["her1"] = cells.her1[region.index]
+	columns["her7"] = cells.her7[region.index]
+	columns["section"] = cells.section[region.index]
+	columns["slice"] = region.slice_index + 1
+	return columns
+
+def slice_columns(region): # columns of the slices table for one region
+	stats = region.slice_statistics()
+	columns = {}
+	columns["region"] = numpy.full(region.num_slices, region.name)
+	columns["slice"] = stats["slice"]
+	columns["num_cells"] = stats["num_cells"]
+	columns["valid"] = stats["valid"].astype(int)
+	for corner in ["bottom_left_xpos","bottom_right_xpos","top_left_xpos","top_right_xpos","top","bottom"]:
+		columns[corner] = numpy.array([getattr(s, corner) for s in region.slices], dtype=float)
+	for key in STATISTICS:
+		columns[key] = stats[key]
+		for bound in ["_low", "_high"]:	# confidence intervals, if Region.slice_intervals was called
+			if key + bound in region.intervals:
+				columns[key + bound] = region.intervals[key + bound]
+	return columns
+
+def member_columns(region): # columns of the members table for one region
+	cells = region.cells
+	columns = {}
+	columns["region"] = numpy.full(len(region.member_rows), region.name)
+	columns["slice"] = region.member_slices + 1
+	columns["cell"] = region.member_rows
+	columns["her1"] = cells.her1[region.member_rows]
+	columns["her7"] = cells.her7[region.member_rows]
+	columns["her1_bgN"] = cells.her1_bgN(region.member_rows)
+	columns["her7_bgN"] = cells.her7_bgN(region.member_rows)
+	return columns
+
+TABLES = [("cells", cell_columns), ("slices", slice_columns), ("members", member_columns)]
+
+def write_csv(directory, regions, block = 65536): # cells.csv, slices.csv and members.csv, written region by region in blocks of rows
+	for name, table_columns in TABLES:
+		with open(directory + "/" + name + ".csv", "w", newline="") as f:
+			writer = csv.writer(f)
+			header = None
+			for region in regions:
+				columns = table_columns(region)
+				if header is None:
+					header = list(columns)
+					writer.writerow(header)
+				num_rows = len(columns["region"])
+				for start in range(0, num_rows, block):
+					writer.writerows(zip(*[columns[key][start:start+block].tolist() for key in header]))
+
+def write_npz(directory, regions): # cells.npz, slices.npz and members.npz, one array per column
+	for name, table_columns in TABLES:
+		parts = [table_columns(region) for region in regions]
+		columns = {}
+		for key in parts[0]:
+			columns[key] = numpy.concatenate([part[key] for part in parts])
+		numpy.savez(directory + "/" + name + ".npz", **columns)
+
+def write_parquet(directory, regions): # cells.parquet, slices.parquet and members.parquet, one row group per region
+	try:
+		import pyarrow, pyarrow.parquet
+	except ImportError:
+		raise ImportError("writing parquet output requires the pyarrow package")
+	for name, table_columns in TABLES:
+		writer = None
+		try:
+			for region in regions:
+				table = pyarrow.table(table_columns(region))
+				if writer is None:
+					writer = pyarrow.parquet.ParquetWriter(directory + "/" + name + ".parquet", table.schema)
+				writer.write_table(table)
+		finally:
+			if writer is not None:
+				writer.close()
+
+BACKENDS = {"csv": write_csv, "npz": write_npz, "parquet": write_parquet}	# output format -> writer, besides the Excel (xls) layout
+REQUIRES = {"parquet": "pyarrow"}	# output format -> optional package its writer needs
+
+def available(output_format): # whether output_format is known and the packages its writer needs are installed, checked without importing them
+	if output_format == "xls":
+		return True
+	if output_format not in BACKENDS:
+		return False
+	return output_format not in REQUIRES or importlib.util.find_spec(REQUIRES[output_format]) is not None